@@ -0,0 +1,72 @@
+"""
+Compare the vectorized leaf analyzer with the old pure-Python green-ratio loop.
+
+Run from the project root:
+    python -m backend.bench_leaf_analyzer [image ...]
+Without arguments, synthetic leaf photos (healthy, spotted, yellowing) are used.
+"""
+import io
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+
+from . import leaf_analyzer
+
+REPEATS = 20
+
+def legacy_local_plant_analysis(image):
+    """The previous groq_client.local_plant_analysis, kept here as the baseline."""
+    img = Image.open(io.BytesIO(image)).convert('RGB')
+    img = img.resize((100, 100))
+    pixels = list(img.getdata())
+    g_sum = sum(p[1] for p in pixels)
+    total = sum(sum(p) for p in pixels)
+    green_ratio = g_sum / total if total > 0 else 0
+    return "Healthy" if green_ratio > 0.4 else "Requires Investigation"
+
+def synthetic_leaf(kind, size=(1600, 1200), seed=0):
+    """JPEG bytes of a green ellipse on a soil background, with optional symptoms."""
+    rng = np.random.default_rng(seed)
+    w, h = size
+    img = Image.new("RGB", size, (120, 95, 70))
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((w * 0.15, h * 0.1, w * 0.85, h * 0.9), fill=(60, 140, 50))
+    if kind == "spotted":
+        for _ in range(40):
+            x, y = rng.uniform(w * 0.3, w * 0.7), rng.uniform(h * 0.25, h * 0.75)
+            r = rng.uniform(8, 25)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=(90, 55, 30))
+    elif kind == "yellowing":
+        draw.ellipse((w * 0.3, h * 0.25, w * 0.6, h * 0.6), fill=(210, 190, 60))
+    buffer = io.BytesIO()
+    img.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+def _time(fn, data):
+    fn(data)  # warm-up
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        result = fn(data)
+    return (time.perf_counter() - started) * 1000 / REPEATS, result
+
+def bench_leaf_analyzer(paths=()):
+    if paths:
+        samples = [(str(p), open(p, "rb").read()) for p in paths]
+    else:
+        samples = [(kind, synthetic_leaf(kind)) for kind in ("healthy", "spotted", "yellowing")]
+
+    print(f"{'image':<16} {'legacy ms':>10} {'new ms':>8} {'features ms':>12}  legacy verdict -> new verdict")
+    for name, data in samples:
+        legacy_ms, legacy_verdict = _time(legacy_local_plant_analysis, data)
+        new_ms, features = _time(leaf_analyzer.analyze_leaf, data)
+        rgb = leaf_analyzer.load_rgb(data)
+        features_ms, _ = _time(leaf_analyzer.leaf_features, rgb)
+        verdict = leaf_analyzer.leaf_health_result(features)["disease_name"]
+        print(f"{name[-16:]:<16} {legacy_ms:>10.2f} {new_ms:>8.2f} {features_ms:>12.2f}  {legacy_verdict} -> {verdict}")
+        print(f"{'':<16} {features}")
+    print(f"\nLegacy analyzes 100x100 pixels; the new analyzer runs at up to "
+          f"{leaf_analyzer.LEAF_ANALYSIS_SIZE}px on the long edge ({REPEATS} runs each).")
+
+if __name__ == "__main__":
+    bench_leaf_analyzer(sys.argv[1:])
@@ -0,0 +1,95 @@
+"""
+Compare the old sequential shutil.copy2 organize step with the parallel,
+content-hash-named materialization in organize_dataset (copy, hardlink,
+reflink and symlink modes): wall time, images/sec and extra disk used.
+
+Run from the project root:
+    python -m backend.bench_organize ["datasets/raw/archive (1)/PlantVillage"]
+Output trees are written next to datasets/processed_v2 and deleted afterwards.
+"""
+import os
+import sys
+import time
+import random
+import shutil
+from pathlib import Path
+
+from .organize_dataset import (RAW_DATA_DIR, PROCESSED_DATA_DIR, IMAGE_EXTENSIONS, LINK_MODES,
+                               ORGANIZE_WORKERS, dest_name, file_sha256, materialize,
+                               normalize_class_name, run_parallel)
+
+BENCH_DIR = PROCESSED_DATA_DIR.parent / ".bench_organize"
+
+def collect(source_dir):
+    """(path, class) for every image in the class folders of one source directory."""
+    images = []
+    for entry in sorted(os.scandir(source_dir), key=lambda e: e.name):
+        if entry.is_dir() and entry.name != "PlantVillage":
+            for root, dirs, files in os.walk(entry.path):
+                dirs.sort()
+                images.extend((Path(root) / f, normalize_class_name(entry.name))
+                              for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS))
+    return images
+
+def legacy_copy(images, out_dir):
+    """The previous organize_dataset copy loop: one file at a time, random-suffix collisions."""
+    for path, class_name in images:
+        split_dir = out_dir / class_name
+        split_dir.mkdir(parents=True, exist_ok=True)
+        dest_path = split_dir / path.name
+        if dest_path.exists():
+            dest_path = split_dir / f"{path.stem}_{random.randint(1000,9999)}{path.suffix}"
+        shutil.copy2(path, dest_path)
+
+def parallel_materialize(images, hashes, out_dir, mode):
+    tasks = {}
+    for (path, class_name), sha256 in zip(images, hashes):
+        tasks.setdefault(out_dir / class_name / dest_name(sha256, path), path)
+    for class_name in {c for _, c in images}:
+        (out_dir / class_name).mkdir(parents=True, exist_ok=True)
+    run_parallel(lambda item: materialize(item[1], item[0], mode), list(tasks.items()))
+
+def extra_bytes(out_dir, source_inodes):
+    """Disk blocks used by out_dir that aren't shared with the sources (hardlinks count as 0)."""
+    total = 0
+    for root, _, files in os.walk(out_dir):
+        for f in files:
+            st = os.lstat(os.path.join(root, f))
+            if (st.st_dev, st.st_ino) not in source_inodes:
+                total += st.st_blocks * 512
+    return total
+
+def bench_organize(source_dir):
+    images = collect(source_dir)
+    if not images:
+        print(f"No images found under {source_dir}")
+        return
+    source_bytes = sum(p.stat().st_size for p, _ in images)
+    source_inodes = {(st.st_dev, st.st_ino) for st in (p.stat() for p, _ in images)}
+    print(f"{len(images)} images ({source_bytes / 1e6:.1f} MB) from {source_dir}, {ORGANIZE_WORKERS} workers")
+
+    # Hashing also warms the page cache, so every run below reads the sources from memory
+    started = time.perf_counter()
+    hashes = run_parallel(file_sha256, [p for p, _ in images])
+    hash_seconds = time.perf_counter() - started
+
+    runs = [("sequential copy2", lambda out: legacy_copy(images, out))]
+    runs += [(f"parallel {mode}", lambda out, mode=mode: parallel_materialize(images, hashes, out, mode))
+             for mode in LINK_MODES]
+
+    print(f"\n{'method':<18} {'seconds':>8} {'images/sec':>11} {'extra MB':>9}")
+    print(f"{'sha256 (parallel)':<18} {hash_seconds:>8.2f} {len(images) / hash_seconds:>11.1f} {'-':>9}")
+    for name, run in runs:
+        out_dir = BENCH_DIR / name.replace(" ", "_")
+        shutil.rmtree(out_dir, ignore_errors=True)
+        out_dir.mkdir(parents=True)
+        started = time.perf_counter()
+        run(out_dir)
+        seconds = time.perf_counter() - started
+        used = extra_bytes(out_dir, source_inodes)
+        print(f"{name:<18} {seconds:>8.2f} {len(images) / seconds:>11.1f} {used / 1e6:>9.1f}")
+        shutil.rmtree(out_dir)
+    shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    bench_organize(Path(sys.argv[1]) if len(sys.argv) > 1 else RAW_DATA_DIR / "archive (1)/PlantVillage")
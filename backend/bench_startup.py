@@ -0,0 +1,52 @@
+"""
+Measure how long `import backend.main` takes and which modules dominate it.
+
+Run from the project root:
+    python -m backend.bench_startup
+"""
+import sys
+import time
+import subprocess
+
+TOP_N = 15
+
+def import_times(module="backend.main"):
+    """Run `python -X importtime -c "import <module>"`; returns ({module: cumulative_us}, wall_s)."""
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit(f"import {module} failed")
+
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        # "import time:       self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative, wall
+
+def bench_startup():
+    cumulative, wall = import_times()
+    print(f"Total wall time (interpreter + import backend.main): {wall:.2f} s\n")
+
+    print(f"{'backend module':<32} {'cumulative ms':>14}")
+    for name, us in sorted(cumulative.items(), key=lambda item: -item[1]):
+        if name.startswith("backend"):
+            print(f"{name:<32} {us / 1000:>14.1f}")
+
+    # Top-level third-party packages only (their submodules are included in the cumulative figure)
+    third_party = {name: us for name, us in cumulative.items()
+                   if "." not in name and not name.startswith("backend")}
+    print(f"\n{'top imports':<32} {'cumulative ms':>14}")
+    for name, us in sorted(third_party.items(), key=lambda item: -item[1])[:TOP_N]:
+        print(f"{name:<32} {us / 1000:>14.1f}")
+
+    heavy = [name for name in ("tensorflow", "google.generativeai", "groq") if name in cumulative]
+    print(f"\nHeavy SDKs imported at startup: {', '.join(heavy) or 'none'}")
+
+if __name__ == "__main__":
+    bench_startup()
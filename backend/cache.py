@@ -0,0 +1,210 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Shared SQLite file for every persistent cache tier (one table per cache)
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "./cache.db")
+
+
+def digest_key(digest: str, *parts) -> str:
+    """Cache key from a hex digest, suffixed with any extra key parts (e.g. language)."""
+    if parts:
+        return digest + ":" + ":".join(str(p) for p in parts)
+    return digest
+
+
+def content_key(data, *parts) -> str:
+    """SHA-256 of the raw bytes, suffixed with any extra key parts (e.g. language)."""
+    return digest_key(hashlib.sha256(data).hexdigest(), *parts)
+
+
+class TieredCache:
+    """
+    Two-tier JSON cache: a bounded in-memory LRU in front of a SQLite table.
+    Entries expire after `ttl` seconds; the SQLite tier is trimmed to `max_rows`
+    (oldest first) so it cannot grow without bound.
+    """
+
+    def __init__(self, name: str, max_entries: int = 256, ttl: float = 7 * 24 * 3600,
+                 max_rows: int = 10000, db_path: Optional[str] = CACHE_DB_PATH):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.db_path = db_path
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        # _lock guards the in-memory LRU and counters and is taken on the event loop;
+        # _db_lock serializes the SQLite connection, which only worker threads hold for long
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._writes = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if db_path:
+            try:
+                self._conn = sqlite3.connect(db_path, check_same_thread=False)
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.name} ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                    "expires REAL NOT NULL, accessed REAL NOT NULL)"
+                )
+                self._conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.name}_accessed ON {self.name} (accessed)"
+                )
+                self._conn.commit()
+            except Exception as e:
+                print(f"[WARN] {self.name} persistent tier disabled: {e}")
+                self._conn = None
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        return self._disk_get(key)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() for the event loop: memory hits answer inline, SQLite runs in a worker thread."""
+        value = self._memory_get(key)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self._disk_get, key)
+
+    def _memory_get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+            return None
+
+    def _disk_get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        found = None
+        if self._conn is not None:
+            with self._db_lock:
+                try:
+                    row = self._conn.execute(
+                        f"SELECT value, expires FROM {self.name} WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row and row[1] > now:
+                        found = (json.loads(row[0]), row[1])
+                        self._conn.execute(
+                            f"UPDATE {self.name} SET accessed = ? WHERE key = ?", (now, key)
+                        )
+                        self._conn.commit()
+                    elif row:
+                        self._conn.execute(f"DELETE FROM {self.name} WHERE key = ?", (key,))
+                        self._conn.commit()
+                except Exception as e:
+                    print(f"{self.name} read error: {e}")
+
+        with self._lock:
+            if found is not None:
+                self._remember(key, *found)
+                self.hits += 1
+                self.disk_hits += 1
+                return found[0]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires)
+        self._disk_set(key, value, expires)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """set() for the event loop: the memory tier updates inline, the SQLite write runs in a worker thread."""
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires)
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_set, key, value, expires)
+
+    def _disk_set(self, key: str, value: Any, expires: float) -> None:
+        now = time.time()
+        if self._conn is None:
+            return
+        trimmed = 0
+        with self._db_lock:
+            try:
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO {self.name} (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires, now)
+                )
+                self._writes += 1
+                # Trim expired and least-recently-used rows every so often, not on every write
+                if self._writes % 100 == 0:
+                    trimmed = self._trim(now)
+                self._conn.commit()
+            except Exception as e:
+                print(f"{self.name} write error: {e}")
+        if trimmed:
+            with self._lock:
+                self.evictions += trimmed
+
+    def _remember(self, key: str, value: Any, expires: float) -> None:
+        self._memory[key] = (value, expires)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _trim(self, now: float) -> int:
+        """Delete expired and over-limit rows (caller holds _db_lock); returns how many."""
+        cur = self._conn.execute(f"DELETE FROM {self.name} WHERE expires <= ?", (now,))
+        removed = max(cur.rowcount, 0)
+        cur = self._conn.execute(
+            f"DELETE FROM {self.name} WHERE key IN ("
+            f"SELECT key FROM {self.name} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,)
+        )
+        return removed + max(cur.rowcount, 0)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.execute(f"DELETE FROM {self.name}")
+                self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        disk_entries = None
+        if self._conn is not None:
+            with self._db_lock:
+                try:
+                    disk_entries = self._conn.execute(f"SELECT COUNT(*) FROM {self.name}").fetchone()[0]
+                except Exception:
+                    pass
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+            }
@@ -0,0 +1,245 @@
+"""
+Pre-resized, sharded copy of datasets/processed_v2 for training and evaluation.
+
+Each split becomes fixed-size .npy shards of 160x160 uint8 RGB images plus
+int16 labels, and an index.json with class names, shard list, source paths and
+a fingerprint of the source files, so shards from an older processed_v2 are
+detected (and rebuilt by train.py) instead of silently used.
+JPEG decode + resize is paid once, here; training reads the shards through
+a parallel-interleaved, prefetched tf.data pipeline.
+
+Run from the project root after organize_dataset.py:
+    python -m backend.dataset_shards            # convert train/val/test
+    python -m backend.dataset_shards --bench    # also compare read throughput
+"""
+import os
+import json
+import hashlib
+import time
+import random
+import argparse
+import numpy as np
+from pathlib import Path
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+# Configuration
+DATA_DIR = Path("datasets/processed_v2")
+SHARDS_DIR = Path("datasets/shards")
+IMG_SIZE = (160, 160)
+SHARD_SIZE = 2048  # 2048 x 160x160x3 bytes ~ 157 MB per shard
+READ_CHUNK = 64    # rows handed to tf.data per read
+# Memory for the row-level shuffle buffer (shards are also pre-shuffled and read interleaved)
+SHUFFLE_BUFFER_MB = int(os.getenv("SHUFFLE_BUFFER_MB", 64))
+CONVERT_WORKERS = os.cpu_count() or 4
+SEED = 123
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+def _decode(path):
+    """RGB, bilinear resize to IMG_SIZE, as image_dataset_from_directory does."""
+    with Image.open(path) as img:
+        # JPEG: decode at the smallest 1/2..1/8 scale still >= 2x the target size
+        img.draft("RGB", (IMG_SIZE[0] * 2, IMG_SIZE[1] * 2))
+        return np.asarray(img.convert("RGB").resize(IMG_SIZE, Image.BILINEAR), dtype=np.uint8)
+
+def load_index(split, shards_dir=SHARDS_DIR):
+    """index.json of a converted split, or None if it hasn't been converted."""
+    index_path = Path(shards_dir) / split / "index.json"
+    if not index_path.exists():
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+def split_files(split_dir):
+    """(class names, [(path, label)]) for one processed_v2 split, in a stable order."""
+    split_dir = Path(split_dir)
+    class_names = sorted(p.name for p in split_dir.iterdir() if p.is_dir())
+    files = [(str(path), label)
+             for label, name in enumerate(class_names)
+             for path in sorted((split_dir / name).iterdir())
+             if path.suffix.lower() in IMAGE_EXTENSIONS]
+    return class_names, files
+
+def source_fingerprint(files):
+    """Changes whenever a source image is added, removed, relabelled or rewritten."""
+    digest = hashlib.sha256(f"{IMG_SIZE}".encode())
+    for path, label in files:
+        stat = os.stat(path)
+        digest.update(f"{path}:{label}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+def is_current(split, data_dir=DATA_DIR, shards_dir=SHARDS_DIR):
+    """
+    True if the split's shards were converted from the processed_v2 files as they
+    are now. Shards without their source tree (copied to a training box) can't be
+    checked and count as current.
+    """
+    index = load_index(split, shards_dir)
+    if index is None:
+        return False
+    split_dir = Path(data_dir) / split
+    if not split_dir.exists():
+        return True
+    return index.get("source_fingerprint") == source_fingerprint(split_files(split_dir)[1])
+
+def convert_split(split, data_dir=DATA_DIR, shards_dir=SHARDS_DIR, shard_size=SHARD_SIZE):
+    """Decode, resize and shard one split; returns its index."""
+    class_names, files = split_files(Path(data_dir) / split)
+    # Taken before decoding: a file rewritten mid-conversion makes the shards stale, not current
+    fingerprint = source_fingerprint(files)
+    # Mix classes across shards so interleaved reads see every class early
+    random.Random(SEED).shuffle(files)
+
+    out_dir = Path(shards_dir) / split
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob("*.npy"):
+        stale.unlink()
+
+    print(f"Converting {len(files)} {split} images into {out_dir}...")
+    started = time.perf_counter()
+    shards = []
+    failed = []
+    with ThreadPoolExecutor(max_workers=CONVERT_WORKERS) as pool:
+        for start in range(0, len(files), shard_size):
+            chunk = files[start:start + shard_size]
+            number = len(shards)
+            images_path = out_dir / f"images-{number:05d}.npy"
+            images = np.lib.format.open_memmap(images_path, mode="w+", dtype=np.uint8,
+                                               shape=(len(chunk),) + IMG_SIZE + (3,))
+            labels = np.empty(len(chunk), dtype=np.int16)
+            kept = 0
+            # Pillow releases the GIL while decoding/resizing, so threads scale
+            for (path, label), array in zip(chunk, pool.map(_safe_decode, [p for p, _ in chunk])):
+                if array is None:
+                    failed.append(path)
+                    continue
+                images[kept] = array
+                labels[kept] = label
+                kept += 1
+            images.flush()
+            del images
+            if kept < len(chunk):
+                # Drop the rows reserved for unreadable files
+                trimmed = np.load(images_path, mmap_mode="r")[:kept].copy()
+                np.save(images_path, trimmed)
+            labels_path = out_dir / f"labels-{number:05d}.npy"
+            np.save(labels_path, labels[:kept])
+            shards.append({"images": images_path.name, "labels": labels_path.name, "count": kept})
+
+    seconds = time.perf_counter() - started
+    skipped = set(failed)
+    count = sum(s["count"] for s in shards)
+    index = {
+        "split": split,
+        "class_names": class_names,
+        "image_size": list(IMG_SIZE),
+        "count": count,
+        "shards": shards,
+        "files": [path for path, _ in files if path not in skipped],
+        "failed": failed,
+        "source_fingerprint": fingerprint,
+    }
+    with open(out_dir / "index.json", "w") as f:
+        json.dump(index, f)
+    rate = count / seconds if seconds else 0
+    print(f"  {count} images in {len(shards)} shards, {seconds:.1f}s ({rate:.1f} images/sec)"
+          + (f", {len(failed)} unreadable" if failed else ""))
+    return index
+
+def _safe_decode(path):
+    try:
+        return _decode(path)
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return None
+
+def shard_dataset(split, batch_size, shuffle=True, shards_dir=SHARDS_DIR, label_mode="categorical"):
+    """
+    tf.data pipeline over a converted split: shards are read in parallel
+    (interleave), shuffled, batched and prefetched. Yields (float32 images in
+    0-255, labels) like image_dataset_from_directory, and carries the same
+    `class_names` / `file_paths` attributes.
+    """
+    import tensorflow as tf
+
+    index = load_index(split, shards_dir)
+    if index is None:
+        raise FileNotFoundError(f"No shards for '{split}' in {shards_dir}; run python -m backend.dataset_shards")
+    split_dir = Path(shards_dir) / split
+    shards = index["shards"]
+    num_classes = len(index["class_names"])
+    image_shape = tuple(index["image_size"]) + (3,)
+
+    def read_shard(number):
+        shard = shards[int(number)]
+        images = np.load(split_dir / shard["images"], mmap_mode="r")
+        labels = np.load(split_dir / shard["labels"])
+        for start in range(0, len(labels), READ_CHUNK):
+            yield np.asarray(images[start:start + READ_CHUNK]), labels[start:start + READ_CHUNK]
+
+    def shard_rows(number):
+        return tf.data.Dataset.from_generator(
+            read_shard, args=(number,),
+            output_signature=(tf.TensorSpec(shape=(None,) + image_shape, dtype=tf.uint8),
+                              tf.TensorSpec(shape=(None,), dtype=tf.int16))
+        ).unbatch()
+
+    order = tf.data.Dataset.range(len(shards))
+    if shuffle:
+        order = order.shuffle(len(shards), seed=SEED, reshuffle_each_iteration=True)
+    ds = order.interleave(shard_rows, cycle_length=min(4, max(len(shards), 1)),
+                          num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    if shuffle:
+        row_bytes = int(np.prod(image_shape))
+        ds = ds.shuffle(max(1, min(index["count"], SHUFFLE_BUFFER_MB * 2**20 // row_bytes)))
+
+    def to_model_inputs(images, labels):
+        images = tf.cast(images, tf.float32)
+        if label_mode == "categorical":
+            return images, tf.one_hot(tf.cast(labels, tf.int32), num_classes)
+        return images, tf.cast(labels, tf.int32)
+
+    ds = ds.batch(batch_size).map(to_model_inputs, num_parallel_calls=tf.data.AUTOTUNE)
+    # The generator hides the length from Keras; restore it for progress bars and steps
+    ds = ds.apply(tf.data.experimental.assert_cardinality(-(-index["count"] // batch_size)))
+    ds = ds.prefetch(tf.data.AUTOTUNE)
+    ds.class_names = index["class_names"]
+    ds.file_paths = index["files"]
+    return ds
+
+def bench_read(split, batch_size=64):
+    """Images/sec for one pass of image_dataset_from_directory vs the shard reader."""
+    import tensorflow as tf
+
+    def one_pass(ds):
+        # Second pass: the first one also pays for pipeline/graph setup
+        for _ in range(2):
+            started = time.perf_counter()
+            images = sum(int(batch[0].shape[0]) for batch in ds)
+            seconds = time.perf_counter() - started
+        return images, images / seconds if seconds else 0
+
+    directory = tf.keras.utils.image_dataset_from_directory(
+        DATA_DIR / split, image_size=IMG_SIZE, batch_size=batch_size, label_mode='categorical')
+    results = {
+        "directory": one_pass(directory.prefetch(tf.data.AUTOTUNE)),
+        "shards": one_pass(shard_dataset(split, batch_size)),
+    }
+    print(f"\n{'reader':<10} {'images':>8} {'images/sec':>11}")
+    for name, (images, rate) in results.items():
+        print(f"{name:<10} {images:>8} {rate:>11.1f}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert datasets/processed_v2 into training shards.")
+    parser.add_argument("--splits", nargs="+", default=["train", "val", "test"])
+    parser.add_argument("--bench", action="store_true", help="compare read throughput on the train split")
+    args = parser.parse_args()
+    for split in args.splits:
+        if (DATA_DIR / split).exists():
+            convert_split(split)
+        else:
+            print(f"Skipping {split}: {DATA_DIR / split} not found")
+    if args.bench:
+        bench_read("train")
@@ -0,0 +1,175 @@
+"""
+Export the trained Keras model to an int8-quantized TFLite model and compare
+the two on held-out images.
+
+Run from the project root after train.py:
+    python -m backend.export_model
+"""
+import os
+import json
+import time
+import random
+import numpy as np
+import tensorflow as tf
+from pathlib import Path
+
+from .ml_engine import KerasBackend, TFLiteBackend, load_image_array, publish_version
+
+# Configuration
+DATA_DIR = Path("datasets/processed_v2")
+MODELS_DIR = Path("models")
+KERAS_MODEL = MODELS_DIR / "plant_disease_model.keras"
+TFLITE_MODEL = MODELS_DIR / "plant_disease_model_int8.tflite"
+REPORT_PATH = MODELS_DIR / "export_report.json"
+TRAINING_REPORT_PATH = MODELS_DIR / "training_report.json"
+# Serving-path Keras accuracy this far below train.py's test accuracy means the
+# serving preprocessing doesn't match what the model was trained on
+MAX_ACCURACY_GAP = 0.05
+CALIBRATION_SAMPLES = 300
+EVAL_SAMPLES = 1000
+SEED = 123
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+
+def sample_images(split_dir, limit):
+    """Up to `limit` (path, class_name) pairs, spread evenly across class folders."""
+    rng = random.Random(SEED)
+    per_class = {}
+    for class_dir in sorted(p for p in split_dir.iterdir() if p.is_dir()):
+        files = [p for p in class_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS]
+        rng.shuffle(files)
+        per_class[class_dir.name] = files
+
+    samples = []
+    while len(samples) < limit and any(per_class.values()):
+        for class_name, files in per_class.items():
+            if files and len(samples) < limit:
+                samples.append((files.pop(), class_name))
+    return samples
+
+def export_tflite(calibration):
+    print(f"Loading {KERAS_MODEL}...")
+    model = tf.keras.models.load_model(KERAS_MODEL)
+
+    # Calibrate on exactly what the server feeds the model (raw 0-255 pixels, the
+    # same range train.py trains on; preprocess_input is inside the graph)
+    def representative_dataset():
+        for path, _ in calibration:
+            yield [load_image_array(path)[np.newaxis]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.int8
+    converter.inference_output_type = tf.int8
+
+    print(f"Quantizing with {len(calibration)} calibration images...")
+    TFLITE_MODEL.write_bytes(converter.convert())
+    print(f"Saved {TFLITE_MODEL} ({TFLITE_MODEL.stat().st_size / 1e6:.1f} MB)")
+
+def input_quantization(tflite_path):
+    """Input scale/zero point of the exported model and the float range it can represent."""
+    interpreter = tf.lite.Interpreter(model_path=str(tflite_path))
+    details = interpreter.get_input_details()[0]
+    scale, zero_point = details["quantization"]
+    info = np.iinfo(details["dtype"]) if details["dtype"] != np.float32 else None
+    if info is None or not scale:
+        return {"scale": None, "zero_point": None, "range": None}
+    return {"scale": float(scale), "zero_point": int(zero_point),
+            "range": [round(float((info.min - zero_point) * scale), 3),
+                      round(float((info.max - zero_point) * scale), 3)]}
+
+def evaluate(backend, samples, class_indices):
+    """Top-1 accuracy, predictions and batch-1 latency for one backend."""
+    correct = 0
+    predictions = []
+    latencies = []
+    for path, class_name in samples:
+        batch = load_image_array(path)[np.newaxis]
+        started = time.perf_counter()
+        probabilities = backend.predict(batch)[0]
+        latencies.append(time.perf_counter() - started)
+        predicted = int(np.argmax(probabilities))
+        predictions.append(predicted)
+        correct += int(predicted == class_indices.get(class_name, -1))
+
+    latencies = np.array(latencies[1:] or latencies) * 1000  # drop warm-up call
+    return predictions, {
+        "accuracy": round(correct / len(samples), 4),
+        "mean_ms": round(float(latencies.mean()), 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+    }
+
+def export_model():
+    if not KERAS_MODEL.exists():
+        print(f"Error: {KERAS_MODEL} not found. Run train.py first.")
+        return
+
+    calibration = sample_images(DATA_DIR / "val", CALIBRATION_SAMPLES)
+    if not calibration:
+        print(f"Error: no calibration images under {DATA_DIR / 'val'}")
+        return
+    export_tflite(calibration)
+
+    with open(MODELS_DIR / "class_indices.json") as f:
+        class_indices = json.load(f)
+    eval_split = DATA_DIR / "test" if (DATA_DIR / "test").exists() else DATA_DIR / "val"
+    samples = sample_images(eval_split, EVAL_SAMPLES)
+    print(f"Comparing backends on {len(samples)} images from {eval_split}...")
+
+    report = {"eval_split": str(eval_split), "eval_images": len(samples),
+              "calibration_images": len(calibration)}
+    all_predictions = {}
+    for backend_cls, path in ((KerasBackend, KERAS_MODEL), (TFLiteBackend, TFLITE_MODEL)):
+        started = time.perf_counter()
+        backend = backend_cls(path)
+        load_seconds = time.perf_counter() - started
+        predictions, metrics = evaluate(backend, samples, class_indices)
+        metrics["load_s"] = round(load_seconds, 2)
+        metrics["size_mb"] = round(os.path.getsize(path) / 1e6, 2)
+        report[backend.name] = metrics
+        all_predictions[backend.name] = predictions
+
+    agreement = np.mean(np.array(all_predictions["keras"]) == np.array(all_predictions["tflite"]))
+    report["top1_agreement"] = round(float(agreement), 4)
+
+    # Sanity checks that catch a serving path that doesn't match training
+    report["input_quantization"] = input_quantization(TFLITE_MODEL)
+    warnings = []
+    value_range = report["input_quantization"]["range"]
+    if value_range and value_range[1] - value_range[0] < 128:
+        warnings.append(f"int8 input range {value_range} is far narrower than 0-255 pixels; "
+                        "calibration images were not fed at the training input scale")
+    if TRAINING_REPORT_PATH.exists():
+        with open(TRAINING_REPORT_PATH) as f:
+            test = json.load(f).get("test")
+        if test:
+            report["training_test_accuracy"] = test["accuracy"]
+            if report["keras"]["accuracy"] < test["accuracy"] - MAX_ACCURACY_GAP:
+                warnings.append(f"Keras accuracy through the serving preprocessing ({report['keras']['accuracy']:.4f}) "
+                                f"is below train.py's test accuracy ({test['accuracy']:.4f})")
+    report["warnings"] = warnings
+
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=4)
+
+    print(f"\n{'backend':<8} {'accuracy':>9} {'mean ms':>8} {'p95 ms':>8} {'load s':>7} {'size MB':>8}")
+    for name in ("keras", "tflite"):
+        m = report[name]
+        print(f"{name:<8} {m['accuracy']:>9.4f} {m['mean_ms']:>8.2f} {m['p95_ms']:>8.2f} "
+              f"{m['load_s']:>7.2f} {m['size_mb']:>8.2f}")
+    print(f"Top-1 agreement: {report['top1_agreement']:.4f}")
+    quantization = report["input_quantization"]
+    if quantization["scale"]:
+        print(f"int8 input: scale {quantization['scale']:.5f}, zero point {quantization['zero_point']}, "
+              f"range {quantization['range']}")
+    for warning in warnings:
+        print(f"[WARN] {warning}")
+    print(f"Report saved to {REPORT_PATH}")
+
+    publish_version([KERAS_MODEL, TFLITE_MODEL, MODELS_DIR / "class_indices.json", REPORT_PATH],
+                    models_dir=MODELS_DIR)
+
+if __name__ == "__main__":
+    export_model()
@@ -1,109 +1,559 @@
 import os
+import sys
+import re
 import json
+import io
+import time
 import base64
-import requests
-import google.generativeai as genai
-from PIL import Image
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
+from . import http_client, warmup, leaf_analyzer
+from .provider_router import router
+from .cache import TieredCache, content_key
+
 load_dotenv()
 
 # API Keys
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 PLANT_ID_API_KEY = os.getenv("PLANT_ID_API_KEY")
 
-# Configure Gemini
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
+# Provider timeouts (seconds)
+PLANT_ID_TIMEOUT = float(os.getenv("PLANT_ID_TIMEOUT", 20))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 90))
+TRANSLATE_TIMEOUT = float(os.getenv("TRANSLATE_TIMEOUT", 30))
+
+# Per-string translations keyed by sha256(text) + language; disease names and
+# treatments recur constantly, so most fields never reach Gemini twice
+translation_cache = TieredCache(
+    "translation_cache",
+    max_entries=int(os.getenv("TRANSLATION_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("TRANSLATION_CACHE_TTL", 30 * 24 * 3600)),
+    max_rows=int(os.getenv("TRANSLATION_CACHE_MAX_ROWS", 100000)),
+)
+
+PLANT_ID_URL = "https://plant.id/api/v3/identification"
+
+# Images up to this size are sent to Gemini inline instead of via upload_file
+GEMINI_INLINE_MAX_BYTES = int(os.getenv("GEMINI_INLINE_MAX_BYTES", 15 * 1024 * 1024))
+# Vision models in preference order (Pro for accuracy, Flash as the fallback tier)
+GEMINI_MODELS = [m.strip() for m in os.getenv("GEMINI_MODELS", "gemini-2.5-pro,gemini-2.5-flash").split(",") if m.strip()]
+# Uploaded files live 48h server-side; reuse the handle for a little less than that
+GEMINI_FILE_TTL = float(os.getenv("GEMINI_FILE_TTL", 47 * 3600))
+
+# Provider racing: "race" fires the cloud providers in parallel (staggered by
+# PROVIDER_HEDGE_DELAY seconds per priority rank), "sequential" tries them in order.
+PROVIDER_MODE = os.getenv("PROVIDER_MODE", "race")
+PROVIDER_HEDGE_DELAY = float(os.getenv("PROVIDER_HEDGE_DELAY", 0))
+
+# Lower priority number = preferred. A result below min_confidence is only
+# used if no provider returns an acceptable answer.
+PROVIDER_SETTINGS = {
+    "plant_id": {
+        "priority": int(os.getenv("PLANT_ID_PRIORITY", 0)),
+        "min_confidence": float(os.getenv("PLANT_ID_MIN_CONFIDENCE", 0.3)),
+        "concurrency": int(os.getenv("PLANT_ID_CONCURRENCY", 8)),
+    },
+    "gemini": {
+        "priority": int(os.getenv("GEMINI_PRIORITY", 1)),
+        "min_confidence": float(os.getenv("GEMINI_MIN_CONFIDENCE", 0.0)),
+        "concurrency": int(os.getenv("GEMINI_CONCURRENCY", 4)),
+    },
+}
+
+# Local-first cascade: the on-device DiseaseDetector answers on its own when it
+# is confident and the class is one of the crops it was trained to diagnose
+LOCAL_CASCADE = os.getenv("LOCAL_CASCADE", "true").lower() == "true"
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("LOCAL_CONFIDENCE_THRESHOLD", 0.85))
+LOCAL_CASCADE_CROPS = {
+    c.strip() for c in os.getenv("LOCAL_CASCADE_CROPS", "Tomato,Potato,Chilli,Paddy,Banana").split(",") if c.strip()
+}
+_local_detector_unavailable = False
+# Thread loading the local model for a request that arrived before warm-up finished
+_local_loader = None
+_local_no_version_logged = False
+
+# Per-provider in-flight limits, one set per event loop
+_provider_semaphores = {}
+
+_genai_module = None
+_genai_lock = threading.Lock()
 
-def analyze_plant_disease(image_path):
+def _genai():
     """
-    Main Analysis Entry Point.
+    google.generativeai, imported and configured on first use (the SDK and its
+    gRPC/protobuf stack are the bulk of this module's import cost).
+    """
+    global _genai_module
+    if _genai_module is None:
+        with _genai_lock:
+            if _genai_module is None:
+                with warmup.timed("gemini_sdk"):
+                    import google.generativeai as genai
+                    # Configure Gemini
+                    if GOOGLE_API_KEY:
+                        genai.configure(api_key=GOOGLE_API_KEY)
+                _genai_module = genai
+    return _genai_module
+
+async def _genai_async():
+    """_genai() for async callers: the first import runs in a thread, not on the event loop."""
+    if _genai_module is not None:
+        return _genai_module
+    return await asyncio.to_thread(_genai)
+
+def _is_path(image):
+    return isinstance(image, (str, os.PathLike))
+
+def _describe(image):
+    if _is_path(image):
+        return image
+    return f"<{len(image)} byte image>"
+
+def _image_bytes(image):
+    """Bytes-like view of an image given as a path or an in-memory buffer."""
+    if _is_path(image):
+        with open(image, "rb") as f:
+            return f.read()
+    return image
+
+def _image_mime_type(data):
+    head = bytes(data[:12])
+    if head.startswith(b"\x89PNG"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+def analyze_plant_disease(image):
+    """
+    Main Analysis Entry Point. `image` is a file path or bytes-like buffer.
     Checks for Plant.id (dedicated API) first, then Gemini (general AI),
     finally falls back to local threshold analysis.
     """
-    print(f"Starting Analysis for {image_path}...")
+    print(f"Starting Analysis for {_describe(image)}...")
+    
+    # 0. Local model first: confident in-domain predictions never reach a paid API
+    if LOCAL_CASCADE:
+        local_result = _local_model_result(_run_local_detector(image))
+        if local_result:
+            return local_result
     
     # 1. Try Plant.id (Dedicated Plant Disease API) - High Accuracy
     if PLANT_ID_API_KEY:
         print("Using Plant.id API...")
-        plant_id_result = try_plant_id_api(image_path)
+        plant_id_result = try_plant_id_api(image)
         if plant_id_result:
-            return plant_id_result
+            return _tag_source(plant_id_result, "plant_id")
     
     # 2. Try Google Gemini (Vision AI) - High Accuracy
     if GOOGLE_API_KEY:
         print("Using Google Gemini API...")
-        gemini_result = try_gemini_analysis(image_path)
+        gemini_result = try_gemini_analysis(image)
         if gemini_result:
-            return gemini_result
+            return _tag_source(gemini_result, "gemini")
             
-    # 3. Final Fallback: Local Pixel Analysis - Low Accuracy
-    print("Warning: No valid API keys found. Falling back to primitive local analysis.")
-    return local_plant_analysis(image_path)
+    # 3. Final Fallback: Offline Leaf Colour Analysis - Low Accuracy
+    print("Warning: No valid API keys found. Falling back to offline leaf analysis.")
+    return local_plant_analysis(image)
 
-def try_plant_id_api(image_path):
-    """Implementation for Kindwise Plant.id (Nature.id) API v3."""
+async def analyze_plant_disease_async(image):
+    """
+    Async twin of analyze_plant_disease. Provider I/O is awaited, so one worker
+    can hold many in-flight diagnoses without tying up the threadpool.
+    In "race" mode the cloud providers run concurrently and the first acceptable
+    answer wins; in "sequential" mode they are tried one after another.
+    """
+    print(f"Starting Analysis for {_describe(image)}...")
+    
+    if LOCAL_CASCADE:
+        local_result = _local_model_result(await _run_local_detector_async(image))
+        if local_result:
+            return local_result
+    
+    if PROVIDER_MODE == "race":
+        result = await race_providers(image)
+        if result:
+            return result
+    else:
+        for name, provider in _cloud_providers():
+            print(f"Using {name} provider...")
+            result = await provider(image)
+            if result:
+                return _tag_source(result, name)
+
+    print("Warning: No valid API keys found. Falling back to offline leaf analysis.")
+    return await asyncio.to_thread(local_plant_analysis, image)
+
+async def analyze_plant_disease_stream(image):
+    """
+    Streaming twin of analyze_plant_disease_async for /predict/stream. Yields
+    ("fields", {..., "provider": name}) while Gemini is still writing its answer,
+    then exactly one ("result", result) whose "source" names the provider that
+    produced it. Plant.id races the Gemini stream as in race_providers: the first
+    acceptable answer wins. Fields are held back while another provider could
+    still win, so the client only sees partial answers likely to be the final one.
+    """
+    print(f"Starting Analysis for {_describe(image)}...")
+
+    if LOCAL_CASCADE:
+        local_result = _local_model_result(await _run_local_detector_async(image))
+        if local_result:
+            yield "result", local_result
+            return
+
+    sources = {}
+    if PLANT_ID_API_KEY:
+        sources["plant_id"] = _single_result(_limited("plant_id", try_plant_id_api_async)(image))
+    if GOOGLE_API_KEY:
+        sources["gemini"] = stream_gemini_analysis_async(image)
+
+    events = asyncio.Queue()
+
+    async def pump(name, source):
+        try:
+            async for event, payload in source:
+                await events.put((name, event, payload))
+        except Exception as e:
+            print(f"{name} failed: {e!r}")
+            await events.put((name, "result", None))
+
+    tasks = [asyncio.create_task(pump(name, source)) for name, source in sources.items()]
+    results = {}
+    held = {}  # provider -> fields not yet sent (another provider could still win)
+    try:
+        while len(results) < len(tasks):
+            name, event, payload = await events.get()
+            pending = set(sources) - set(results)
+            if event == "fields":
+                if pending == {name}:
+                    yield "fields", dict(payload, provider=name)
+                else:
+                    held.setdefault(name, {}).update(payload)
+                continue
+            results[name] = payload
+            if payload and _is_acceptable(name, payload):
+                print(f"Provider race won by {name}")
+                yield "result", _tag_source(payload, name)
+                return
+            # The others are out of the race: whatever the survivor has written so far can go out
+            pending.discard(name)
+            if len(pending) == 1 and held.get(next(iter(pending))):
+                survivor = next(iter(pending))
+                yield "fields", dict(held.pop(survivor), provider=survivor)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    # Nothing acceptable: best-priority weak answer, else the offline analyzer
+    weak = sorted((PROVIDER_SETTINGS[name]["priority"], name) for name, result in results.items() if result)
+    if weak:
+        print(f"Provider race: using below-threshold result from {weak[0][1]}")
+        yield "result", _tag_source(results[weak[0][1]], weak[0][1])
+        return
+    print("Warning: No valid API keys found. Falling back to offline leaf analysis.")
+    yield "result", await asyncio.to_thread(local_plant_analysis, image)
+
+def _tag_source(result, provider):
+    """Copy of a provider result with "source" set, unless the result already names one."""
+    return result if result.get("source") else dict(result, source=provider)
+
+async def _single_result(call):
+    """Adapt a one-shot provider coroutine to the (event, payload) stream shape."""
+    yield "result", await call
+
+def _local_engine():
+    """The ml_engine module, or None if the local model can't be used."""
+    global _local_detector_unavailable
+    if _local_detector_unavailable:
+        return None
+    try:
+        from . import ml_engine
+        ml_engine.get_detector()
+        return ml_engine
+    except Exception as e:
+        # TensorFlow isn't installed in every deployment; stop trying after the first miss
+        print(f"Local model unavailable, cascade disabled: {e}")
+        _local_detector_unavailable = True
+        return None
+
+def _local_engine_nowait():
+    """
+    The ml_engine module if the local model is loaded and has a version to serve,
+    else None (escalate) without waiting. Safe on the event loop: a request that
+    arrives before warm-up has loaded TensorFlow starts the load in a background
+    thread instead of blocking on the import or on ml_engine's init lock.
+    """
+    global _local_loader, _local_no_version_logged
+    if _local_detector_unavailable:
+        return None
+    engine = sys.modules.get(__package__ + ".ml_engine") if __package__ else None
+    if engine is None or engine.detector is None:
+        if _local_loader is None or not _local_loader.is_alive():
+            _local_loader = threading.Thread(target=_local_engine, name="local-model-load", daemon=True)
+            _local_loader.start()
+        return None
+    # No version published yet: skip preprocessing and the batcher until the watcher loads one
+    if engine.detector.active is None:
+        if not _local_no_version_logged:
+            print("Local model has no version to serve; escalating to providers until one is published")
+            _local_no_version_logged = True
+        return None
+    _local_no_version_logged = False
+    return engine
+
+def _run_local_detector(image):
+    """Raw DiseaseDetector prediction, or None if the local model can't be used."""
+    engine = _local_engine()
+    if engine is None or engine.get_detector().active is None:
+        return None
+    return engine.get_detector().predict(image)
+
+async def _run_local_detector_async(image):
+    """Like _run_local_detector, but the forward pass is shared with concurrent requests."""
+    engine = _local_engine_nowait()
+    if engine is None:
+        return None
+    try:
+        array = await asyncio.to_thread(engine.get_detector().preprocess, image)
+    except Exception as e:
+        print(f"Local model preprocessing failed: {e}")
+        return None
+    return await engine.get_inference_batcher().submit(array)
+
+def local_inference_stats():
+    """Active model version and micro-batcher counters, or None if the local model was never loaded."""
+    engine = sys.modules.get(__package__ + ".ml_engine") if __package__ else None
+    if engine is None or engine.detector is None:
+        return None
+    stats = engine.inference_batcher.stats() if engine.inference_batcher is not None else {}
+    return {"model": engine.detector.info(), **stats}
+
+def _local_model_result(prediction):
+    """
+    Map a confident, in-domain DiseaseDetector prediction (e.g. "Tomato__Early_blight")
+    onto the provider result shape; None means escalate to the cloud providers.
+    """
+    if not prediction:
+        return None
+    label = prediction.get("label", "")
+    confidence = float(prediction.get("confidence") or 0)
+    parts = label.split("__")
+    # Crop__Condition only; fruit-type and ripeness classes are not diagnoses
+    if len(parts) != 2 or parts[0] not in LOCAL_CASCADE_CROPS:
+        print(f"Local model: '{label}' is outside the cascade label set, escalating")
+        return None
+    if confidence < LOCAL_CONFIDENCE_THRESHOLD:
+        print(f"Local model: {label} at {confidence:.2f} below threshold, escalating")
+        return None
+
+    crop, condition = parts
+    healthy = condition.lower() in ("healthy", "normal")
+    disease_name = "Healthy" if healthy else condition.replace("_", " ").strip().title()
+    print(f"Local model answered: {crop} / {disease_name} ({confidence:.2f})")
+    return {
+        "plant_name": crop,
+        "disease_name": disease_name,
+        "confidence": confidence,
+        "details": {
+            "severity": "None" if healthy else "Medium",
+            "symptoms": (f"No disease detected on this {crop.lower()} leaf." if healthy
+                         else f"Leaf symptoms consistent with {disease_name} on {crop.lower()}."),
+            "prevention": "Rotate crops, avoid overhead watering and remove infected debris.",
+            "treatment": ("No treatment needed; continue regular care." if healthy
+                          else f"Remove affected leaves and apply a treatment labelled for {disease_name}; "
+                               "consult a local agri-input shop for the right product."),
+        },
+        "source": "local_model",
+        "model_version": prediction.get("model_version"),
+    }
+
+def _provider_semaphore(name):
+    key = (id(asyncio.get_running_loop()), name)
+    semaphore = _provider_semaphores.get(key)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(PROVIDER_SETTINGS[name]["concurrency"])
+        _provider_semaphores[key] = semaphore
+    return semaphore
+
+def _limited(name, provider):
+    """Wrap a provider call so at most `concurrency` calls to it are in flight."""
+    async def call(image):
+        async with _provider_semaphore(name):
+            return await provider(image)
+    return call
+
+def _cloud_providers():
+    """Configured cloud providers as (name, async fn), best priority first."""
+    providers = []
+    if PLANT_ID_API_KEY:
+        providers.append(("plant_id", _limited("plant_id", try_plant_id_api_async)))
+    if GOOGLE_API_KEY:
+        providers.append(("gemini", _limited("gemini", try_gemini_analysis_async)))
+    return sorted(providers, key=lambda p: PROVIDER_SETTINGS[p[0]]["priority"])
+
+def _is_acceptable(name, result):
     try:
-        with open(image_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode("utf-8")
+        confidence = float(result.get("confidence") or 0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    return confidence >= PROVIDER_SETTINGS[name]["min_confidence"]
+
+async def race_providers(image, hedge_delay=None):
+    """
+    Hedged race across the configured cloud providers.
+    Provider N starts after N * hedge_delay seconds, or immediately once an
+    earlier provider has failed. The first acceptable result wins and the
+    remaining calls are cancelled; weak results are kept as a fallback and the
+    best-priority one is returned if nothing better arrives.
+    """
+    providers = _cloud_providers()
+    if not providers:
+        return None
+    if hedge_delay is None:
+        hedge_delay = PROVIDER_HEDGE_DELAY
+
+    give_up_waiting = asyncio.Event()
+
+    async def run(rank, provider):
+        if rank and hedge_delay > 0:
+            try:
+                await asyncio.wait_for(give_up_waiting.wait(), timeout=rank * hedge_delay)
+            except asyncio.TimeoutError:
+                pass
+        return await provider(image)
+
+    tasks = {
+        asyncio.create_task(run(rank, provider)): name
+        for rank, (name, provider) in enumerate(providers)
+    }
+    pending = set(tasks)
+    fallback = None  # (priority, name, result)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=lambda t: PROVIDER_SETTINGS[tasks[t]]["priority"]):
+                name = tasks[task]
+                result = None if task.exception() else task.result()
+                if result and _is_acceptable(name, result):
+                    print(f"Provider race won by {name}")
+                    return _tag_source(result, name)
+                if result:
+                    candidate = (PROVIDER_SETTINGS[name]["priority"], name, result)
+                    if fallback is None or candidate[0] < fallback[0]:
+                        fallback = candidate
+                # A failed or weak answer: start any hedged providers right away
+                give_up_waiting.set()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if fallback:
+        print(f"Provider race: using below-threshold result from {fallback[1]}")
+        return _tag_source(fallback[2], fallback[1])
+    return None
+
+def _plant_id_request(image):
+    """Headers and JSON payload for a Plant.id v3 identification call."""
+    image_data = base64.b64encode(_image_bytes(image)).decode("utf-8")
+    
+    headers = {
+        "Content-Type": "application/json",
+        "Api-Key": PLANT_ID_API_KEY
+    }
+    payload = {
+        "images": [image_data],
+        "latitude": 0,
+        "longitude": 0,
+        "similar_images": True,
+        "health": "all"
+    }
+    return headers, payload
+
+def _parse_plant_id_response(data):
+    """Map a Plant.id v3 response body onto our diagnosis dict (None if no match)."""
+    # Extract identification results
+    result = data.get("result", {})
+    classification = result.get("classification", {})
+    suggestions = classification.get("suggestions", [])
+    
+    if not suggestions:
+        return None
         
-        url = "https://plant.id/api/v3/identification"
-        headers = {
-            "Content-Type": "application/json",
-            "Api-Key": PLANT_ID_API_KEY
-        }
-        payload = {
-            "images": [image_data],
-            "latitude": 0,
-            "longitude": 0,
-            "similar_images": True,
-            "health": "all"
-        }
+    best_match = suggestions[0]
+    
+    # Extract health results
+    health = result.get("is_healthy", {})
+    disease_info = result.get("disease", {})
+    disease_suggestions = disease_info.get("suggestions", [])
+    
+    is_healthy = health.get("binary", True)
+    disease_name = "Healthy"
+    if not is_healthy and disease_suggestions:
+        disease_name = disease_suggestions[0].get("name", "Unknown Disease")
         
-        response = requests.post(url, headers=headers, json=payload, timeout=20)
+    return {
+        "plant_name": best_match.get("name", "Unknown Plant"),
+        "disease_name": disease_name,
+        "confidence": best_match.get("probability", 0.9),
+        "details": {
+            "description": f"Overall health: {'Good' if is_healthy else 'Requires Attention'}.",
+            "prevention": "Ensure proper watering and sunlight.",
+            "treatment": "Consult a local nursery for plant-specific care."
+        }
+    }
+
+def _record_plant_id(breaker, response, started):
+    # 4xx other than rate limiting is our request's fault, not an outage
+    if response.status_code == 429 or response.status_code >= 500:
+        breaker.record_failure()
+    else:
+        breaker.record_success(time.perf_counter() - started)
+
+def try_plant_id_api(image):
+    """Implementation for Kindwise Plant.id (Nature.id) API v3."""
+    breaker = router.breaker("plant_id")
+    if not breaker.allow():
+        print("Plant.id circuit open; skipping")
+        return None
+    try:
+        headers, payload = _plant_id_request(image)
+        started = time.perf_counter()
+        response = http_client.post("plant_id", PLANT_ID_URL, headers=headers, json=payload, timeout=PLANT_ID_TIMEOUT)
+        _record_plant_id(breaker, response, started)
         if response.status_code == 201:
-            data = response.json()
-            # Extract identification results
-            result = data.get("result", {})
-            classification = result.get("classification", {})
-            suggestions = classification.get("suggestions", [])
-            
-            if not suggestions:
-                return None
-                
-            best_match = suggestions[0]
-            
-            # Extract health results
-            health = result.get("is_healthy", {})
-            disease_info = result.get("disease", {})
-            disease_suggestions = disease_info.get("suggestions", [])
-            
-            is_healthy = health.get("binary", True)
-            disease_name = "Healthy"
-            if not is_healthy and disease_suggestions:
-                disease_name = disease_suggestions[0].get("name", "Unknown Disease")
-                
-            return {
-                "plant_name": best_match.get("name", "Unknown Plant"),
-                "disease_name": disease_name,
-                "confidence": best_match.get("probability", 0.9),
-                "details": {
-                    "description": f"Overall health: {'Good' if is_healthy else 'Requires Attention'}.",
-                    "prevention": "Ensure proper watering and sunlight.",
-                    "treatment": "Consult a local nursery for plant-specific care."
-                }
-            }
+            return _parse_plant_id_response(response.json())
     except Exception as e:
+        breaker.record_failure()
         print(f"Plant.id error: {e}")
     return None
 
-def try_gemini_analysis(image_path):
-    """Implementation for Gemini Pro/Flash Vision."""
+async def try_plant_id_api_async(image):
+    """Non-blocking Plant.id call (pooled httpx client) for the async /predict pipeline."""
+    breaker = router.breaker("plant_id")
+    if not breaker.allow():
+        print("Plant.id circuit open; skipping")
+        return None
     try:
-        uploaded_file = genai.upload_file(image_path)
-        
-        prompt = """
+        if _is_path(image):
+            headers, payload = await asyncio.to_thread(_plant_id_request, image)
+        else:
+            headers, payload = _plant_id_request(image)
+        started = time.perf_counter()
+        response = await http_client.apost("plant_id", PLANT_ID_URL, headers=headers,
+                                           json=payload, timeout=PLANT_ID_TIMEOUT)
+        _record_plant_id(breaker, response, started)
+        if response.status_code == 201:
+            return _parse_plant_id_response(response.json())
+    except Exception as e:
+        breaker.record_failure()
+        print(f"Plant.id error: {e!r}")
+    return None
+
+GEMINI_PROMPT = """
 You are an elite botanist and plant pathologist. Carefully analyze the provided plant photo.
 1. Accurately identify the plant species. Pay extremely close attention to leaf shape, edges, vein patterns, and overall morphology. Do NOT guess generic plants like 'Tomato' or 'Rose' unless you are certain. Give the common name (and scientific name if appropriate).
 2. Identify any visible diseases, pests, fungal infections, or nutrient deficiencies accurately. 
@@ -135,99 +585,289 @@ You MUST respond with valid JSON only, in EXACTLY the following structure:
   }
 }
 """
+
+def _parse_gemini_text(res_text):
+    """Parse Gemini's JSON answer (tolerating markdown fences) into our diagnosis dict."""
+    res_text = res_text.strip()
+    
+    if not res_text:
+        print("Gemini returned empty response")
+        return None
+    
+    # Parse JSON from markdown or raw text just in case the model ignores mime type
+    if "```json" in res_text:
+        res_text = res_text.split("```json")[1].split("```")[0].strip()
+    elif "```" in res_text:
+        res_text = res_text.split("```")[1].split("```")[0].strip()
+    
+    # Try to extract JSON from response
+    try:
+        result = json.loads(res_text)
         
-        # Try primary Pro model for highest accuracy
-        model = genai.GenerativeModel('gemini-2.5-pro')
-        try:
-            response = model.generate_content(
-                [prompt, uploaded_file],
-                generation_config={"response_mime_type": "application/json"}
-            )
-        except Exception as e:
-            print(f"Fallback to gemini-2.5-flash because: {e}")
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(
-                [prompt, uploaded_file],
-                generation_config={"response_mime_type": "application/json"}
-            )
+        # Transform response to match frontend format
+        if result and 'details' in result:
+            details = result['details']
+            
+            # Convert treatment to treatments array if missing
+            if 'treatment' in details and 'treatments' not in details:
+                treatment = details.pop('treatment')
+                if treatment:
+                    details['treatments'] = [
+                        {"type": "General", "description": treatment, "cost_approx": "Varies"}
+                    ]
             
-        res_text = response.text.strip()
+            # Ensure required fields exist
+            if 'severity' not in details:
+                details['severity'] = "Medium"
+            if 'symptoms' not in details:
+                details['symptoms'] = details.get('description', 'No symptoms recorded')
+                
+        return result
+    except json.JSONDecodeError:
+        match = re.search(r'\{.*\}', res_text, re.DOTALL)
+        if match:
+            return json.loads(match.group())
+        print(f"Failed to parse response: {res_text[:200]}")
+        return None
+
+# Top-level scalar fields the prompt asks for first; readable before the JSON is complete
+_STREAM_FIELDS = {
+    "plant_name": re.compile(r'"plant_name"\s*:\s*"((?:[^"\\]|\\.)*)"'),
+    "disease_name": re.compile(r'"disease_name"\s*:\s*"((?:[^"\\]|\\.)*)"'),
+    "confidence": re.compile(r'"confidence"\s*:\s*(-?\d+(?:\.\d+)?)\s*[,}\n]'),
+}
+
+def partial_gemini_fields(text):
+    """Fields already complete in a partial Gemini JSON answer, e.g. {"plant_name": "Tomato"}."""
+    fields = {}
+    for name, pattern in _STREAM_FIELDS.items():
+        match = pattern.search(text)
+        if match:
+            value = match.group(1)
+            fields[name] = float(value) if name == "confidence" else json.loads(f'"{value}"')
+    return fields
+
+def _report_gemini_error(e):
+    error_msg = str(e)
+    if "leaked" in error_msg.lower() or "403" in error_msg:
+        print("ERROR: GOOGLE_API_KEY is reported as leaked. Please update it in .env.")
+    else:
+        print(f"Gemini error: {error_msg or repr(e)}")
+
+class GeminiRegistry:
+    """
+    Process-wide Gemini handles: one GenerativeModel per model name, plus
+    uploaded-file handles memoized by image hash until shortly before the
+    Files API expires them (48h), so retries never re-upload the same image.
+    """
+
+    def __init__(self, file_ttl=GEMINI_FILE_TTL, max_files=512):
+        self.file_ttl = file_ttl
+        self.max_files = max_files
+        self._models = {}
+        self._files = OrderedDict()  # sha256 -> (file handle, expires)
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.upload_reuses = 0
+
+    def model(self, name):
+        model = self._models.get(name)
+        if model is None:
+            with self._lock:
+                model = self._models.get(name)
+                if model is None:
+                    model = _genai().GenerativeModel(name)
+                    self._models[name] = model
+        return model
+
+    def uploaded_file(self, image):
+        """Files API handle for `image` (path or bytes-like), uploading only on a miss."""
+        data = _image_bytes(image)
+        digest = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            entry = self._files.get(digest)
+            if entry is not None and entry[1] > now:
+                self._files.move_to_end(digest)
+                self.upload_reuses += 1
+                return entry[0]
+
+        if _is_path(image):
+            handle = _genai().upload_file(image)
+        else:
+            handle = _genai().upload_file(io.BytesIO(data), mime_type=_image_mime_type(data))
+
+        expires = now + self.file_ttl
+        expiration = getattr(handle, "expiration_time", None)
+        if expiration is not None and hasattr(expiration, "timestamp"):
+            # Stop reusing a few minutes before the server-side expiry
+            expires = min(expires, expiration.timestamp() - 300)
+        with self._lock:
+            self.uploads += 1
+            self._files[digest] = (handle, expires)
+            self._files.move_to_end(digest)
+            while len(self._files) > self.max_files:
+                self._files.popitem(last=False)
+        return handle
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": sorted(self._models),
+                "uploaded_files": len(self._files),
+                "uploads": self.uploads,
+                "upload_reuses": self.upload_reuses,
+            }
+
+gemini_registry = GeminiRegistry()
+
+def _gemini_image_part(image):
+    """
+    Inline image part for Gemini when the image is in memory and small enough;
+    otherwise a (memoized) Files API upload.
+    """
+    if not _is_path(image) and len(image) <= GEMINI_INLINE_MAX_BYTES:
+        return {"mime_type": _image_mime_type(image), "data": bytes(image)}
+    return gemini_registry.uploaded_file(image)
+
+def try_gemini_analysis(image):
+    """
+    Implementation for Gemini Pro/Flash Vision. Tiers are tried in GEMINI_MODELS
+    order, skipping any whose circuit breaker is open.
+    """
+    try:
+        uploaded_file = _gemini_image_part(image)
         
-        if not res_text:
-            print("Gemini returned empty response")
-            return None
+        response = None
+        for model_name in GEMINI_MODELS:
+            breaker = router.breaker(f"gemini:{model_name}")
+            if not breaker.allow():
+                continue
+            started = time.perf_counter()
+            try:
+                response = gemini_registry.model(model_name).generate_content(
+                    [GEMINI_PROMPT, uploaded_file],
+                    generation_config={"response_mime_type": "application/json"}
+                )
+                breaker.record_success(time.perf_counter() - started)
+                break
+            except Exception as e:
+                breaker.record_failure()
+                print(f"{model_name} failed, trying next Gemini tier: {e}")
         
-        # Parse JSON from markdown or raw text just in case the model ignores mime type
-        if "```json" in res_text:
-            res_text = res_text.split("```json")[1].split("```")[0].strip()
-        elif "```" in res_text:
-            res_text = res_text.split("```")[1].split("```")[0].strip()
+        if response is None:
+            print("No healthy Gemini tier available")
+            return None
+        return _parse_gemini_text(response.text)
+    except Exception as e:
+        _report_gemini_error(e)
+    return None
+
+async def try_gemini_analysis_async(image):
+    """Async Gemini Pro/Flash Vision: awaits the SDK's async generate call with a timeout."""
+    try:
+        await _genai_async()
+        # The SDK has no async upload; keep it off the event loop
+        if _is_path(image) or len(image) > GEMINI_INLINE_MAX_BYTES:
+            uploaded_file = await asyncio.to_thread(_gemini_image_part, image)
+        else:
+            uploaded_file = _gemini_image_part(image)
         
-        # Try to extract JSON from response
-        try:
-            result = json.loads(res_text)
+        response = None
+        for model_name in GEMINI_MODELS:
+            breaker = router.breaker(f"gemini:{model_name}")
+            if not breaker.allow():
+                continue
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    gemini_registry.model(model_name).generate_content_async(
+                        [GEMINI_PROMPT, uploaded_file],
+                        generation_config={"response_mime_type": "application/json"}
+                    ),
+                    timeout=GEMINI_TIMEOUT
+                )
+                breaker.record_success(time.perf_counter() - started)
+                break
+            except Exception as e:
+                breaker.record_failure()
+                print(f"{model_name} failed, trying next Gemini tier: {e!r}")
             
-            # Transform response to match frontend format
-            if result and 'details' in result:
-                details = result['details']
-                
-                # Convert treatment to treatments array if missing
-                if 'treatment' in details and 'treatments' not in details:
-                    treatment = details.pop('treatment')
-                    if treatment:
-                        details['treatments'] = [
-                            {"type": "General", "description": treatment, "cost_approx": "Varies"}
-                        ]
-                
-                # Ensure required fields exist
-                if 'severity' not in details:
-                    details['severity'] = "Medium"
-                if 'symptoms' not in details:
-                    details['symptoms'] = details.get('description', 'No symptoms recorded')
-                    
-            return result
-        except json.JSONDecodeError:
-            import re
-            match = re.search(r'\{.*\}', res_text, re.DOTALL)
-            if match:
-                return json.loads(match.group())
-            print(f"Failed to parse response: {res_text[:200]}")
+        if response is None:
+            print("No healthy Gemini tier available")
             return None
+        return _parse_gemini_text(response.text)
     except Exception as e:
-        error_msg = str(e)
-        if "leaked" in error_msg.lower() or "403" in error_msg:
-            print("ERROR: GOOGLE_API_KEY is reported as leaked. Please update it in .env.")
-        else:
-            print(f"Gemini error: {error_msg}")
+        _report_gemini_error(e)
     return None
 
-def local_plant_analysis(image_path):
-    """Primitive fallback logic if no external API is available."""
+async def stream_gemini_analysis_async(image):
+    """
+    Streaming Gemini Vision call: yields ("fields", {...}) whenever another top-level
+    field becomes readable in the partial answer, then ("result", parsed or None).
+    Tiers are tried in GEMINI_MODELS order until one starts answering.
+    """
     try:
-        img = Image.open(image_path).convert('RGB')
-        img = img.resize((100, 100))
-        pixels = list(img.getdata())
-        
-        g_sum = sum(p[1] for p in pixels)
-        total = sum(sum(p) for p in pixels)
-        green_ratio = g_sum / total if total > 0 else 0
-        
-        if green_ratio > 0.4:
-            return {
-                "plant_name": "Healthy Plant",
-                "disease_name": "Healthy",
-                "confidence": 0.5,
-                "details": {"description": "Looks green.", "prevention": "Continue care.", "treatment": "None."}
-            }
+        await _genai_async()
+        if _is_path(image) or len(image) > GEMINI_INLINE_MAX_BYTES:
+            uploaded_file = await asyncio.to_thread(_gemini_image_part, image)
         else:
-            return {
-                "plant_name": "Stressed Plant",
-                "disease_name": "Requires Investigation",
-                "confidence": 0.4,
-                "details": {"description": "Low green levels.", "prevention": "Check lighting.", "treatment": "Take a better photo."}
-            }
-    except:
-        return {"plant_name": "Unknown", "disease_name": "Error", "confidence": 0.0, "details": {}}
+            uploaded_file = _gemini_image_part(image)
+
+        async with _provider_semaphore("gemini"):
+            for model_name in GEMINI_MODELS:
+                breaker = router.breaker(f"gemini:{model_name}")
+                if not breaker.allow():
+                    continue
+                started = time.perf_counter()
+                deadline = started + GEMINI_TIMEOUT
+                text = ""
+                sent = {}
+                try:
+                    response = await asyncio.wait_for(
+                        gemini_registry.model(model_name).generate_content_async(
+                            [GEMINI_PROMPT, uploaded_file],
+                            generation_config={"response_mime_type": "application/json"},
+                            stream=True
+                        ),
+                        timeout=GEMINI_TIMEOUT
+                    )
+                    chunks = response.__aiter__()
+                    while True:
+                        try:
+                            chunk = await asyncio.wait_for(
+                                chunks.__anext__(), timeout=max(deadline - time.perf_counter(), 0.001)
+                            )
+                        except StopAsyncIteration:
+                            break
+                        text += chunk.text
+                        fields = {k: v for k, v in partial_gemini_fields(text).items() if sent.get(k) != v}
+                        if fields:
+                            sent.update(fields)
+                            yield "fields", fields
+                    breaker.record_success(time.perf_counter() - started)
+                except Exception as e:
+                    breaker.record_failure()
+                    print(f"{model_name} stream failed: {e!r}")
+                    if sent:
+                        # The client already has this tier's fields; don't splice in another model's answer
+                        yield "result", None
+                        return
+                    continue
+                yield "result", _parse_gemini_text(text)
+                return
+        print("No healthy Gemini tier available")
+    except Exception as e:
+        _report_gemini_error(e)
+    yield "result", None
+
+def local_plant_analysis(image):
+    """Offline fallback if no external API is available: HSV leaf segmentation and symptom features."""
+    try:
+        return leaf_analyzer.leaf_health_result(leaf_analyzer.analyze_leaf(image))
+    except Exception as e:
+        print(f"Leaf analysis failed: {e}")
+        return {"plant_name": "Unknown", "disease_name": "Error", "confidence": 0.0, "details": {}, "source": "leaf_analyzer"}
 
 def stream_groq(query):
     """Use Groq API for chat assistant."""
@@ -262,18 +902,64 @@ def translate_text(text, target_language):
         return text
 
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        model = gemini_registry.model('gemini-2.5-flash')
         prompt = f"Translate the following JSON data to {target_language}. Maintain the exact JSON structure and only translate the values: {text}"
         response = model.generate_content(prompt)
         return response.text.strip()
     except:
         return text
 
+async def translate_strings_async(strings, target_language):
+    """
+    Translate a list of strings field by field. Cached translations are reused;
+    the misses are deduplicated and sent to Gemini in one JSON-array request.
+    Raises if the model call fails or returns something unusable.
+    """
+    if not GOOGLE_API_KEY or target_language == "en":
+        return list(strings)
+
+    results = list(strings)
+    missing = {}  # source text -> indices that need it
+    for i, text in enumerate(strings):
+        if not isinstance(text, str) or not text.strip():
+            continue
+        cached = await translation_cache.aget(content_key(text.encode("utf-8"), target_language))
+        if cached is not None:
+            results[i] = cached
+        else:
+            missing.setdefault(text, []).append(i)
+
+    if not missing:
+        return results
+
+    sources = list(missing)
+    await _genai_async()
+    model = gemini_registry.model('gemini-2.5-flash')
+    prompt = (
+        f"Translate each string in the following JSON array to {target_language}. "
+        "Respond with a JSON array of the same length and order containing only the translations: "
+        + json.dumps(sources, ensure_ascii=False)
+    )
+    response = await asyncio.wait_for(
+        model.generate_content_async(prompt, generation_config={"response_mime_type": "application/json"}),
+        timeout=TRANSLATE_TIMEOUT
+    )
+    translated = json.loads(response.text.strip())
+    if not isinstance(translated, list) or len(translated) != len(sources):
+        raise ValueError("Translation returned a mismatched array")
+
+    for source, target in zip(sources, translated):
+        target = str(target)
+        await translation_cache.aset(content_key(source.encode("utf-8"), target_language), target)
+        for i in missing[source]:
+            results[i] = target
+    return results
+
 def get_disease_info(plant_name, disease_name):
     """Retrieve detailed disease info via Gemini."""
     if not GOOGLE_API_KEY: return None
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        model = gemini_registry.model('gemini-2.5-flash')
         prompt = f"Provide gardening details for {plant_name} with {disease_name}. Return in JSON format with description, prevention, and treatment."
         response = model.generate_content(prompt)
         return json.loads(response.text.strip())
@@ -0,0 +1,137 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Dict
+
+import httpx
+
+# Shared outbound HTTP layer: one keep-alive client per provider (sync and
+# async), so repeat calls reuse TCP/TLS connections instead of re-handshaking.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))
+
+PROVIDER_HTTP = {
+    "plant_id": {
+        "timeout": float(os.getenv("PLANT_ID_TIMEOUT", 20)),
+        "pool_size": int(os.getenv("PLANT_ID_POOL_SIZE", HTTP_POOL_SIZE)),
+    },
+    "overpass": {
+        "timeout": float(os.getenv("OVERPASS_TIMEOUT", 60)),
+        "pool_size": int(os.getenv("OVERPASS_POOL_SIZE", 4)),
+    },
+    "default": {
+        "timeout": float(os.getenv("HTTP_TIMEOUT", 30)),
+        "pool_size": HTTP_POOL_SIZE,
+    },
+}
+
+
+class _ProviderStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.new_connections = 0
+        self.seconds = 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        reused = max(self.requests - self.new_connections, 0)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "reused_connections": reused,
+            "reuse_rate": round(reused / self.requests, 4) if self.requests else None,
+            "avg_ms": round(1000 * self.seconds / self.requests, 1) if self.requests else None,
+        }
+
+
+_lock = threading.Lock()
+_stats: Dict[str, _ProviderStats] = {}
+_clients: Dict[str, httpx.Client] = {}
+_async_clients: Dict[tuple, httpx.AsyncClient] = {}
+
+
+def _settings(provider: str) -> Dict[str, Any]:
+    return PROVIDER_HTTP.get(provider, PROVIDER_HTTP["default"])
+
+
+def _provider_stats(provider: str) -> _ProviderStats:
+    with _lock:
+        return _stats.setdefault(provider, _ProviderStats())
+
+
+def _limits(provider: str) -> httpx.Limits:
+    size = _settings(provider)["pool_size"]
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size,
+                        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY)
+
+
+def get_client(provider: str = "default") -> httpx.Client:
+    """Process-wide pooled sync client for `provider`."""
+    client = _clients.get(provider)
+    if client is None:
+        with _lock:
+            client = _clients.get(provider)
+            if client is None:
+                client = httpx.Client(timeout=_settings(provider)["timeout"], limits=_limits(provider))
+                _clients[provider] = client
+    return client
+
+
+def get_async_client(provider: str = "default") -> httpx.AsyncClient:
+    """Pooled async client for `provider`, one per running event loop."""
+    key = (id(asyncio.get_running_loop()), provider)
+    client = _async_clients.get(key)
+    if client is None:
+        client = httpx.AsyncClient(timeout=_settings(provider)["timeout"], limits=_limits(provider))
+        _async_clients[key] = client
+    return client
+
+
+def post(provider: str, url: str, **kwargs) -> httpx.Response:
+    stats = _provider_stats(provider)
+
+    def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            stats.new_connections += 1
+
+    started = time.perf_counter()
+    try:
+        return get_client(provider).post(url, extensions={"trace": trace}, **kwargs)
+    except Exception:
+        stats.errors += 1
+        raise
+    finally:
+        stats.requests += 1
+        stats.seconds += time.perf_counter() - started
+
+
+async def apost(provider: str, url: str, **kwargs) -> httpx.Response:
+    stats = _provider_stats(provider)
+
+    async def trace(event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            stats.new_connections += 1
+
+    started = time.perf_counter()
+    try:
+        return await get_async_client(provider).post(url, extensions={"trace": trace}, **kwargs)
+    except Exception:
+        stats.errors += 1
+        raise
+    finally:
+        stats.requests += 1
+        stats.seconds += time.perf_counter() - started
+
+
+async def aclose() -> None:
+    """Close the async clients owned by the current event loop."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _async_clients if k[0] == loop_id]:
+        await _async_clients.pop(key).aclose()
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {provider: s.snapshot() for provider, s in _stats.items()}
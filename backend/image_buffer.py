@@ -0,0 +1,90 @@
+import os
+import hashlib
+import tempfile
+from typing import Optional, Union
+
+from fastapi import HTTPException, UploadFile
+
+# Reject anything bigger than this outright (phone photos are 4-12 MB)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 25 * 1024 * 1024))
+# Uploads above this size are streamed to a temp file instead of held in RAM
+UPLOAD_SPILL_BYTES = int(os.getenv("UPLOAD_SPILL_BYTES", 16 * 1024 * 1024))
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadBuffer:
+    """
+    One uploaded image, read exactly once. Small uploads live in memory and are
+    handed to providers as a zero-copy memoryview; large ones are spilled to a
+    uniquely named temp file and handed over as a path.
+    """
+
+    def __init__(self, data: Optional[bytes] = None, path: Optional[str] = None,
+                 size: int = 0, sha256: str = ""):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "UploadBuffer":
+        return cls(data=data, size=len(data), sha256=hashlib.sha256(data).hexdigest())
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def image(self) -> Union[memoryview, str]:
+        """What the providers consume: a memoryview, or the spill file path."""
+        if self.path is not None:
+            return self.path
+        return memoryview(self.data)
+
+    def read_bytes(self) -> bytes:
+        if self.path is not None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        return self.data
+
+    def close(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self.data = None
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES,
+                      spill_threshold: int = UPLOAD_SPILL_BYTES) -> UploadBuffer:
+    """Read an UploadFile once into a bounded buffer, hashing as we go."""
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spill = None
+    size = 0
+    try:
+        while True:
+            chunk = await file.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Image larger than {max_bytes} bytes")
+            digest.update(chunk)
+            if spill is None and size > spill_threshold:
+                spill = tempfile.NamedTemporaryFile(prefix="upload_", suffix=".img", delete=False)
+                spill.write(buffer)
+                buffer = bytearray()
+            if spill is not None:
+                spill.write(chunk)
+            else:
+                buffer += chunk
+    except BaseException:
+        if spill is not None:
+            spill.close()
+            os.remove(spill.name)
+        raise
+
+    if spill is not None:
+        spill.close()
+        return UploadBuffer(path=spill.name, size=size, sha256=digest.hexdigest())
+    return UploadBuffer(data=bytes(buffer), size=size, sha256=digest.hexdigest())
@@ -0,0 +1,104 @@
+import io
+import os
+import time
+import threading
+from typing import Any, Dict, Tuple
+
+from PIL import Image, ImageOps
+
+# Longest edge sent to providers; plenty for leaf-level disease features
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", 1536))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", 85))
+# Formats every provider accepts as uploaded (see groq_client._image_mime_type)
+PASSTHROUGH_FORMATS = ("JPEG", "PNG", "WEBP")
+# Embedded metadata that must never reach a provider (GPS, camera, editing history)
+METADATA_KEYS = ("exif", "icc_profile", "xmp", "XML:com.adobe.xmp", "comment")
+
+
+class PreprocessStats:
+    """Running bytes-in / bytes-out counters for the normalization stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    def record(self, bytes_in: int, bytes_out: int, seconds: float) -> None:
+        with self._lock:
+            self.images += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds += seconds
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "images": self.images,
+                "failures": self.failures,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "ratio": round(self.bytes_out / self.bytes_in, 4) if self.bytes_in else None,
+                "avg_ms": round(1000 * self.seconds / self.images, 2) if self.images else None,
+                "max_edge": IMAGE_MAX_EDGE,
+                "jpeg_quality": IMAGE_JPEG_QUALITY,
+            }
+
+
+stats = PreprocessStats()
+
+
+def normalize_image(image, max_edge: int = IMAGE_MAX_EDGE,
+                    quality: int = IMAGE_JPEG_QUALITY) -> Tuple[bytes, Dict[str, Any]]:
+    """
+    Auto-orient, downscale to `max_edge`, drop EXIF/metadata and re-encode as JPEG.
+    Photos that are already small enough, carry no metadata at all and are in a
+    provider-readable format are returned as-is.
+    `image` is a file path or bytes-like buffer. Returns (image_bytes, info).
+    """
+    started = time.perf_counter()
+    if isinstance(image, (str, os.PathLike)):
+        with open(image, "rb") as f:
+            original = f.read()
+    else:
+        original = bytes(image)
+    bytes_in = len(original)
+
+    with Image.open(io.BytesIO(original)) as img:
+        original_size = img.size
+        # Nothing to rotate, shrink or strip: re-encoding would only cost time and (often) bytes
+        no_metadata = not img.getexif() and not any(img.info.get(key) for key in METADATA_KEYS)
+        reusable = no_metadata and max(original_size) <= max_edge and img.format in PASSTHROUGH_FORMATS
+        if reusable and img.mode in ("RGB", "L"):
+            data, final_size = original, original_size
+        else:
+            # Let the JPEG decoder do most of the downscaling (DCT scaling is far cheaper)
+            scale = min(1.0, max_edge / max(original_size))
+            img.draft("RGB", (int(original_size[0] * scale), int(original_size[1] * scale)))
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            out = io.BytesIO()
+            # No exif= argument: metadata (GPS, camera info) is dropped
+            img.save(out, format="JPEG", quality=quality, optimize=True)
+            data, final_size = out.getvalue(), img.size
+
+    elapsed = time.perf_counter() - started
+    stats.record(bytes_in, len(data), elapsed)
+    return data, {
+        "bytes_in": bytes_in,
+        "bytes_out": len(data),
+        "original_size": original_size,
+        "size": final_size,
+        "reencoded": data is not original,
+        "ms": round(elapsed * 1000, 2),
+    }
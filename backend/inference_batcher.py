@@ -0,0 +1,95 @@
+import os
+import time
+import asyncio
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+# Requests arriving within this window are run as one forward pass
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", 16))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", 5))
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-item requests for up to `max_wait_ms` (or until
+    `max_batch_size` items are waiting), runs `batch_fn(items)` once in a worker
+    thread and hands each caller its own result.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = INFERENCE_MAX_BATCH,
+                 max_wait_ms: float = INFERENCE_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.items = 0
+        self.max_queue_depth = 0
+        self.busy_seconds = 0.0
+
+    def _queue(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(id(loop))
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[id(loop)] = queue
+            loop.create_task(self._run(queue))
+        return queue
+
+    async def submit(self, item: Any) -> Any:
+        queue = self._queue()
+        future = asyncio.get_running_loop().create_future()
+        await queue.put((item, future))
+        self.max_queue_depth = max(self.max_queue_depth, queue.qsize())
+        return await future
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = [await queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Callers that gave up (cancelled) don't need a slot in the forward pass
+            batch = [(item, future) for item, future in batch if not future.cancelled()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = await asyncio.to_thread(self.batch_fn, [item for item, _ in batch])
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            with self._lock:
+                self.busy_seconds += time.perf_counter() - started
+                self.batch_sizes[len(batch)] += 1
+                self.items += len(batch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = sum(self.batch_sizes.values())
+            return {
+                "items": self.items,
+                "batches": batches,
+                "avg_batch_size": round(self.items / batches, 2) if batches else None,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                "queue_depth": sum(q.qsize() for q in self._queues.values()),
+                "max_queue_depth": self.max_queue_depth,
+                "avg_batch_ms": round(1000 * self.busy_seconds / batches, 2) if batches else None,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
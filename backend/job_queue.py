@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "./jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+# Finished results are kept this long so reconnecting clients can still fetch them
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", 24 * 3600))
+JOB_POLL_INTERVAL = 1.0
+
+Handler = Callable[[bytes, str], Awaitable[Dict[str, Any]]]
+
+
+class JobQueue:
+    """
+    Persistent diagnosis job queue backed by SQLite, drained by a pool of
+    asyncio workers. Jobs survive restarts: anything left 'running' by a
+    crashed process is re-queued on start().
+    """
+
+    def __init__(self, handler: Handler, db_path: str = JOBS_DB_PATH,
+                 workers: int = JOB_WORKERS, result_ttl: float = JOB_RESULT_TTL):
+        self.handler = handler
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS diagnosis_jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, language TEXT NOT NULL, "
+            "image BLOB, result TEXT, error TEXT, "
+            "created REAL NOT NULL, updated REAL NOT NULL, expires REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS diagnosis_jobs_status ON diagnosis_jobs (status, created)"
+        )
+        self._conn.commit()
+        self._tasks = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._finished: Dict[str, asyncio.Event] = {}
+        # Guards _finished only, so the event loop never waits on a worker's SQLite commit
+        self._events_lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def start(self) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE diagnosis_jobs SET status = 'queued', updated = ? WHERE status = 'running'",
+                (time.time(),)
+            )
+            self._conn.commit()
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"[OK] Job queue started with {self.workers} workers")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # -- client API ----------------------------------------------------------
+
+    def submit(self, image: bytes, language: str = "en") -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO diagnosis_jobs (id, status, language, image, created, updated) "
+                "VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, language, sqlite3.Binary(image), now, now)
+            )
+            self._conn.commit()
+        if self._wakeup is not None:
+            self._signal(self._wakeup)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, result, error, created, updated, expires "
+                "FROM diagnosis_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if not row or (row[6] is not None and row[6] <= time.time()):
+            return None
+        return {
+            "job_id": row[0],
+            "status": row[1],
+            "result": json.loads(row[2]) if row[2] else None,
+            "error": row[3],
+            "created": row[4],
+            "updated": row[5],
+        }
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Long-poll: return the job once finished, or its current state after `timeout`."""
+        if timeout <= 0:
+            return await asyncio.to_thread(self.get, job_id)
+        # Register before reading the status, so a job finishing in between still sets the event
+        with self._events_lock:
+            event = self._finished.setdefault(job_id, asyncio.Event())
+        job = await asyncio.to_thread(self.get, job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            with self._events_lock:
+                self._finished.pop(job_id, None)
+            return job
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return await asyncio.to_thread(self.get, job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM diagnosis_jobs GROUP BY status"
+            ).fetchall()
+        return {
+            "workers": len(self._tasks),
+            "by_status": {status: count for status, count in rows},
+            "completed": self.completed,
+            "failed": self.failed,
+            "result_ttl_seconds": self.result_ttl,
+        }
+
+    # -- workers -------------------------------------------------------------
+
+    def _claim(self):
+        """Atomically move the oldest queued job to 'running' (safe across processes sharing the DB)."""
+        with self._lock:
+            while True:
+                row = self._conn.execute(
+                    "SELECT id, language, image FROM diagnosis_jobs "
+                    "WHERE status = 'queued' ORDER BY created LIMIT 1"
+                ).fetchone()
+                if not row:
+                    return None
+                cur = self._conn.execute(
+                    "UPDATE diagnosis_jobs SET status = 'running', updated = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (time.time(), row[0])
+                )
+                self._conn.commit()
+                if cur.rowcount == 1:
+                    return row[0], row[1], bytes(row[2])
+                # Another process claimed it between our SELECT and UPDATE; try the next one
+
+    def _finish(self, job_id: str, result=None, error: Optional[str] = None) -> None:
+        now = time.time()
+        with self._lock:
+            # Drop the image blob; only the (small) result is retained until expiry
+            self._conn.execute(
+                "UPDATE diagnosis_jobs SET status = ?, result = ?, error = ?, image = NULL, "
+                "updated = ?, expires = ? WHERE id = ?",
+                ("failed" if error else "done", json.dumps(result) if result is not None else None,
+                 error, now, now + self.result_ttl, job_id)
+            )
+            self._conn.commit()
+        # Popped after the commit: a waiter that registered earlier is signalled, a later one sees 'done'
+        with self._events_lock:
+            event = self._finished.pop(job_id, None)
+        if event is not None:
+            self._signal(event)
+
+    def _signal(self, event: asyncio.Event) -> None:
+        """Set an asyncio.Event from any thread (submit/_finish run in worker threads)."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(event.set)
+
+    def _purge_expired(self) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM diagnosis_jobs WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)
+            )
+            self._conn.commit()
+
+    async def _worker(self, number: int) -> None:
+        last_purge = 0.0
+        while True:
+            if number == 0 and time.time() - last_purge > 60:
+                await asyncio.to_thread(self._purge_expired)
+                last_purge = time.time()
+
+            # Clear before claiming: a submit landing after the claim still wakes us
+            self._wakeup.clear()
+            job = await asyncio.to_thread(self._claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            job_id, language, image = job
+            try:
+                result = await self.handler(image, language)
+                await asyncio.to_thread(self._finish, job_id, result)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                await asyncio.to_thread(self._finish, job_id, None, str(e))
+                self.failed += 1
@@ -0,0 +1,207 @@
+"""
+Offline leaf-health analysis with vectorized NumPy colour features.
+
+Used when no provider (local model, Plant.id, Gemini) can answer: the image is
+converted to HSV, leaf pixels are segmented from the background and the share
+of chlorotic (yellowing), necrotic (brown/black) and powdery (white) tissue is
+measured, along with a lesion spot count.
+"""
+import io
+import os
+import numpy as np
+from PIL import Image
+
+# Longest edge the analysis runs at (the old loop used 100x100)
+LEAF_ANALYSIS_SIZE = int(os.getenv("LEAF_ANALYSIS_SIZE", 384))
+
+# HSV thresholds (hue in degrees, saturation/value in 0..1)
+GREEN_HUE = (65.0, 170.0)
+YELLOW_HUE = (38.0, 65.0)
+BROWN_HUE_MAX = 38.0
+# Plant tissue of any health as (hue from, hue to, min saturation). Green-yellow is
+# distinctive; browns and reds overlap skin, soil, wood and brick, so only vivid ones count
+PLANT_COLOURS = ((65.0, 170.0, 0.18), (42.0, 65.0, 0.35), (20.0, 42.0, 0.65), (330.0, 20.0, 0.75))
+
+
+def load_rgb(image, size=LEAF_ANALYSIS_SIZE):
+    """Decode a path or bytes-like image to a uint8 RGB array with longest edge <= size."""
+    source = image if isinstance(image, (str, os.PathLike)) else io.BytesIO(bytes(image))
+    with Image.open(source) as img:
+        # JPEG: let the decoder downscale by 1/2, 1/4 or 1/8 before we touch pixels
+        img.draft("RGB", (size, size))
+        img = img.convert("RGB")
+        img.thumbnail((size, size), Image.BILINEAR)
+        return np.asarray(img)
+
+
+def rgb_to_hsv(rgb):
+    """uint8 (..., 3) RGB -> float32 hue (degrees), saturation, value arrays."""
+    rgb = rgb.astype(np.float32) / 255.0
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    # Elementwise max/min of the three planes; reducing over a length-3 axis is far slower
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    delta = maxc - minc
+    safe_delta = np.where(delta > 0, delta, np.float32(1.0))
+
+    hue = np.where(maxc == r, (g - b) / safe_delta,
+          np.where(maxc == g, (b - r) / safe_delta + 2.0,
+                   (r - g) / safe_delta + 4.0))
+    hue = np.where(hue < 0, hue + 6.0, hue) * 60.0
+    hue[delta == 0] = 0.0
+    saturation = delta / np.where(maxc > 0, maxc, np.float32(1.0))
+    return hue, saturation, maxc
+
+
+def _enclosed(mask):
+    """
+    Pixels with a True pixel somewhere to their left, right, above and below:
+    the filled outline of a (roughly convex) leaf, lesions and holes included.
+    """
+    left = np.logical_or.accumulate(mask, axis=1)
+    right = np.logical_or.accumulate(mask[:, ::-1], axis=1)[:, ::-1]
+    up = np.logical_or.accumulate(mask, axis=0)
+    down = np.logical_or.accumulate(mask[::-1], axis=0)[::-1]
+    return left & right & up & down
+
+
+def _count_spots(mask):
+    """
+    Number of lesion blobs, from the 8-connected Euler number (blobs minus holes)
+    computed with 2x2 bit-quad counts. Single pixels are eroded away first.
+    """
+    core = mask[:-1, :-1] & mask[1:, :-1] & mask[:-1, 1:] & mask[1:, 1:]
+    core = np.pad(core, 1)
+    a, b, c, d = core[:-1, :-1], core[:-1, 1:], core[1:, :-1], core[1:, 1:]
+    ones = a.astype(np.uint8) + b + c + d
+    q1 = np.count_nonzero(ones == 1)
+    q3 = np.count_nonzero(ones == 3)
+    diagonal = np.count_nonzero((ones == 2) & (a == d))
+    return max(0, int(q1 - q3 - 2 * diagonal) // 4)
+
+
+def leaf_features(rgb):
+    """Segmentation coverage and symptom fractions for one uint8 RGB array."""
+    hue, sat, val = rgb_to_hsv(rgb)
+
+    green = (hue >= GREEN_HUE[0]) & (hue <= GREEN_HUE[1]) & (sat >= 0.18) & (val >= 0.12)
+    yellow = (hue >= YELLOW_HUE[0]) & (hue < YELLOW_HUE[1]) & (sat >= 0.25) & (val >= 0.35)
+    brown = (((hue < BROWN_HUE_MAX) | (hue >= 330.0)) & (sat >= 0.15) & (val < 0.65)) | (val < 0.12)
+    white = (sat < 0.12) & (val > 0.7)
+
+    # Lesions sit on the leaf: keep symptom pixels only inside the green outline
+    on_leaf = _enclosed(green)
+    yellow &= on_leaf
+    brown &= on_leaf
+    white &= on_leaf
+    leaf = green | yellow | brown | white
+
+    total = leaf.size
+    leaf_pixels = int(np.count_nonzero(leaf))
+    denominator = max(leaf_pixels, 1)
+    spots = _count_spots(yellow | brown)
+    return {
+        "size": [int(rgb.shape[1]), int(rgb.shape[0])],
+        "coverage": round(leaf_pixels / total, 4),
+        "green": round(int(np.count_nonzero(green)) / denominator, 4),
+        "chlorosis": round(int(np.count_nonzero(yellow)) / denominator, 4),
+        "necrosis": round(int(np.count_nonzero(brown)) / denominator, 4),
+        "powdery": round(int(np.count_nonzero(white)) / denominator, 4),
+        "spots": spots,
+        # Lesion blobs per 10k leaf pixels, comparable across image sizes
+        "spot_density": round(spots * 10000 / denominator, 2),
+    }
+
+
+def plant_coverage(rgb):
+    """
+    Share of the frame coloured like plant tissue of any health: unlike
+    leaf_features' coverage it doesn't need green to outline the leaf, so a
+    fully yellow, brown or red leaf, fruit or banana still counts. Grey, white,
+    black, blue/purple and dull warm pixels (skin, soil, wood) don't.
+    """
+    # Average 4x4 blocks first: sensor/JPEG noise alone would push dull colours over the bar
+    h, w = rgb.shape[0] // 4 * 4, rgb.shape[1] // 4 * 4
+    blocks = rgb[:h, :w].reshape(h // 4, 4, w // 4, 4, 3).mean(axis=(1, 3))
+    hue, sat, val = rgb_to_hsv(blocks)
+    plant = np.zeros(hue.shape, dtype=bool)
+    for start, end, min_sat in PLANT_COLOURS:
+        in_band = (hue >= start) & (hue <= end) if start < end else (hue >= start) | (hue <= end)
+        plant |= in_band & (sat >= min_sat)
+    plant &= val >= 0.12
+    return round(int(np.count_nonzero(plant)) / plant.size, 4)
+
+
+def analyze_leaf(image, size=LEAF_ANALYSIS_SIZE):
+    return leaf_features(load_rgb(image, size))
+
+
+def _severity(fraction):
+    if fraction >= 0.3:
+        return "High"
+    if fraction >= 0.12:
+        return "Medium"
+    return "Low"
+
+
+def leaf_health_result(features):
+    """Turn leaf features into the provider result shape (heuristic, so confidence stays low)."""
+    if features["coverage"] < 0.05:
+        return {
+            "plant_name": "Unknown",
+            "disease_name": "No Leaf Detected",
+            "confidence": 0.1,
+            "details": {
+                "severity": "Unknown",
+                "symptoms": "Too little leaf area was visible to assess plant health.",
+                "prevention": "Photograph a single leaf filling most of the frame in daylight.",
+                "treatment": "Take a closer, well-lit photo of the affected leaf.",
+            },
+            "source": "leaf_analyzer",
+            "features": features,
+        }
+
+    necrosis, chlorosis, powdery = features["necrosis"], features["chlorosis"], features["powdery"]
+    spotty = features["spot_density"] >= 3.0
+    symptomatic = necrosis + chlorosis + powdery
+
+    if symptomatic < 0.05 and not spotty:
+        disease, severity = "Healthy", "None"
+        symptoms = f"Leaf is {features['green']:.0%} green with no visible lesions or yellowing."
+        prevention = "Continue regular watering, feeding and inspection."
+        treatment = "No treatment needed."
+        confidence = 0.55
+    elif powdery >= max(necrosis, chlorosis) and powdery >= 0.05:
+        disease, severity = "Possible Powdery Mildew", _severity(powdery)
+        symptoms = f"White powdery patches cover about {powdery:.0%} of the leaf."
+        prevention = "Improve air circulation and avoid wetting foliage in the evening."
+        treatment = "Remove badly affected leaves; apply sulphur or potassium bicarbonate spray."
+        confidence = 0.4
+    elif necrosis >= chlorosis or spotty:
+        disease = "Leaf Spot / Blight Symptoms" if spotty else "Leaf Necrosis"
+        severity = _severity(necrosis)
+        symptoms = (f"Brown or dark dead tissue covers about {necrosis:.0%} of the leaf"
+                    f" ({features['spots']} distinct spots).")
+        prevention = "Remove infected debris, rotate crops and water at the base of the plant."
+        treatment = "Prune affected leaves and apply a copper-based or labelled fungicide."
+        confidence = 0.45
+    else:
+        disease, severity = "Chlorosis (Leaf Yellowing)", _severity(chlorosis)
+        symptoms = f"About {chlorosis:.0%} of the leaf is yellowing."
+        prevention = "Check soil drainage and nitrogen, iron and magnesium levels."
+        treatment = "Correct watering and apply a balanced fertiliser or micronutrient feed."
+        confidence = 0.4
+
+    return {
+        "plant_name": "Healthy Plant" if disease == "Healthy" else "Stressed Plant",
+        "disease_name": disease,
+        "confidence": confidence,
+        "details": {
+            "severity": severity,
+            "symptoms": symptoms + " (Offline colour analysis; a provider diagnosis is more reliable.)",
+            "prevention": prevention,
+            "treatment": treatment,
+        },
+        "source": "leaf_analyzer",
+        "features": features,
+    }
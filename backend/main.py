@@ -2,26 +2,67 @@ from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
 from typing import List
+from contextlib import asynccontextmanager
 import uvicorn
 import shutil
 import os
+import json
+import asyncio
 import hashlib
 import time
 import random
 
-from . import models, schemas, database, groq_client, places_service
+from . import models, schemas, database, groq_client, places_service, image_preprocess, http_client, warmup, quality_gate
+from .cache import TieredCache, digest_key
+from .image_buffer import UploadBuffer, read_upload
+from .job_queue import JobQueue
+from .similar_index import SimilarIndex, image_signature
+from .provider_router import router as provider_router
 
-try:
-    models.Base.metadata.create_all(bind=database.engine)
-    print("[OK] Database initialized")
-except Exception as e:
-    print(f"[WARN] Database not available: {e}")
-    print("Using fallback mode...")
+# Offline heuristics answer while providers are down; never remember their answers
+# (cache, similar-image index) or a re-upload would skip the providers after they recover
+HEURISTIC_SOURCES = ("leaf_analyzer", "quality_gate")
 
-app = FastAPI(title="Plant Disease Detection API")
+# Pre-load the Gemini SDK and local model after startup instead of on the first request
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+
+def warm_up():
+    """Runs in a background thread once the server is accepting connections."""
+    try:
+        with warmup.timed("database"):
+            models.Base.metadata.create_all(bind=database.engine)
+        print("[OK] Database initialized")
+    except Exception as e:
+        print(f"[WARN] Database not available: {e}")
+        print("Using fallback mode...")
+
+    if not WARMUP_ON_STARTUP:
+        return
+    try:
+        if groq_client.GOOGLE_API_KEY:
+            groq_client._genai()
+        if groq_client.LOCAL_CASCADE:
+            groq_client._local_engine()
+    except Exception as e:
+        print(f"[WARN] Warm-up incomplete: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    job_queue.start()
+    warmup_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    yield
+    if not warmup_task.done():
+        # Thread keeps running until its current import/load finishes; don't block shutdown on it
+        warmup_task.cancel()
+    await job_queue.stop()
+    if similar_index is not None:
+        similar_index.flush()
+    await http_client.aclose()
+
+app = FastAPI(title="Plant Disease Detection API", lifespan=lifespan)
 
 # Ensure the directory exists
 os.makedirs("backend/uploads", exist_ok=True)
@@ -37,6 +78,18 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Diagnosis cache keyed by image bytes + language (skips provider calls on re-uploads)
+diagnosis_cache = TieredCache(
+    "diagnosis_cache",
+    max_entries=int(os.getenv("DIAGNOSIS_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("DIAGNOSIS_CACHE_TTL", 7 * 24 * 3600)),
+    max_rows=int(os.getenv("DIAGNOSIS_CACHE_MAX_ROWS", 10000)),
+)
+
+# Re-shot photos of an already diagnosed leaf reuse that diagnosis (see similar_index.py)
+SIMILAR_INDEX = os.getenv("SIMILAR_INDEX", "true").lower() == "true"
+similar_index = SimilarIndex() if SIMILAR_INDEX else None
+
 # Dependency
 def get_db():
     db = database.SessionLocal()
@@ -53,137 +106,420 @@ def read_root():
 
 from fastapi import Form 
 
-@app.post("/predict", response_model=schemas.PredictionResult)
-def predict_disease(
-    file: UploadFile = File(...), 
-    language: str = Form("en"),
-    db: Session = Depends(get_db)
-):
-    import tempfile
-    temp_file = os.path.join(tempfile.gettempdir(), f"temp_{file.filename}")
-    try:
-        # Save temp file
-        with open(temp_file, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # AI DIAGNOSIS using Groq
-        print(f"Analyzing plant health with Groq AI (Language: {language})...")
-        
+def build_prediction_result(gemini_result: dict) -> schemas.PredictionResult:
+    """Map a raw provider result (Plant.id / Gemini / local) onto the response schema."""
+    # Handle potentially stringified 'details' from Gemini
+    details_data = gemini_result.get("details", {})
+    if isinstance(details_data, str):
         try:
-            gemini_result = groq_client.analyze_plant_disease(temp_file)
-        except Exception as e:
-            print(f"AI Diagnosis Failed: {e}")
-            raise HTTPException(status_code=503, detail=f"AI service unavailable: {str(e)}")
-
-        # Handle potentially stringified 'details' from Gemini
-        details_data = gemini_result.get("details", {})
-        if isinstance(details_data, str):
-            import json
-            try:
-                details_data = json.loads(details_data)
-            except:
-                details_data = {
-                    "description": details_data,
-                    "prevention": "Check plant health closely.",
-                    "treatment": "Provide general care."
-                }
-                
-        # Map Gemini result to response schema - handle null values
-        plant_name = gemini_result.get("plant_name") or "Unknown Plant"
-        disease_name = gemini_result.get("disease_name") or "Analysis Required"
-        confidence = float(gemini_result.get("confidence") or 0.5)
-        
-        # Ensure we have valid details
-        treatments_list = []
-        if isinstance(details_data, dict):
-            description = details_data.get("symptoms") or details_data.get("description") or "Unable to analyze image"
-            prevention = details_data.get("prevention") or "Provide good lighting"
-            severity = details_data.get("severity") or "Moderate"
+            details_data = json.loads(details_data)
+        except:
+            details_data = {
+                "description": details_data,
+                "prevention": "Check plant health closely.",
+                "treatment": "Provide general care."
+            }
             
-            # Extract treatments list
-            raw_treatments = details_data.get("treatments")
-            if raw_treatments and isinstance(raw_treatments, list):
-                for t in raw_treatments:
-                    treatments_list.append(
-                        schemas.TreatmentBase(
-                            type=t.get("type", "General"),
-                            description=t.get("description", str(t)),
-                            cost_approx=t.get("cost_approx", "Varies")
-                        )
-                    )
-            else:
-                treatment = details_data.get("treatment") or "Try again with clearer image"
-                treatments_list = [
+    # Map Gemini result to response schema - handle null values
+    plant_name = gemini_result.get("plant_name") or "Unknown Plant"
+    disease_name = gemini_result.get("disease_name") or "Analysis Required"
+    # Missing confidence defaults to 0.5; an explicit 0 (e.g. a retake request) stays 0
+    confidence = gemini_result.get("confidence")
+    confidence = 0.5 if confidence is None else float(confidence)
+    
+    # Ensure we have valid details
+    treatments_list = []
+    if isinstance(details_data, dict):
+        description = details_data.get("symptoms") or details_data.get("description") or "Unable to analyze image"
+        prevention = details_data.get("prevention") or "Provide good lighting"
+        severity = details_data.get("severity") or "Moderate"
+        
+        # Extract treatments list
+        raw_treatments = details_data.get("treatments")
+        if raw_treatments and isinstance(raw_treatments, list):
+            for t in raw_treatments:
+                treatments_list.append(
                     schemas.TreatmentBase(
-                        type="General",
-                        description=treatment,
-                        cost_approx="Varies"
+                        type=t.get("type", "General"),
+                        description=t.get("description", str(t)),
+                        cost_approx=t.get("cost_approx", "Varies")
                     )
-                ]
+                )
         else:
-            description = "Could not complete analysis"
-            prevention = "Ensure proper lighting"
-            severity = "Moderate"
+            treatment = details_data.get("treatment") or "Try again with clearer image"
             treatments_list = [
                 schemas.TreatmentBase(
                     type="General",
-                    description="Please try again",
+                    description=treatment,
                     cost_approx="Varies"
                 )
             ]
-        
-        final_result = schemas.PredictionResult(
-            plant_name=plant_name,
-            disease_name=disease_name,
-            confidence=confidence,
-            details=schemas.DiseaseBase(
-                name=disease_name,
-                severity=severity,
-                symptoms=description,
-                prevention=prevention,
-                treatments=treatments_list
+    else:
+        description = "Could not complete analysis"
+        prevention = "Ensure proper lighting"
+        severity = "Moderate"
+        treatments_list = [
+            schemas.TreatmentBase(
+                type="General",
+                description="Please try again",
+                cost_approx="Varies"
             )
+        ]
+    
+    return schemas.PredictionResult(
+        plant_name=plant_name,
+        disease_name=disease_name,
+        confidence=confidence,
+        details=schemas.DiseaseBase(
+            name=disease_name,
+            severity=severity,
+            symptoms=description,
+            prevention=prevention,
+            treatments=treatments_list
+        ),
+        model_version=gemini_result.get("model_version"),
+        quality_issues=gemini_result.get("quality_issues"),
+        source=gemini_result.get("source")
+    )
+
+def fallback_prediction_result() -> schemas.PredictionResult:
+    """Safe fallback so we NEVER return a 500 error that breaks CORS."""
+    return schemas.PredictionResult(
+        plant_name="Plant Detected",
+        disease_name="Analysis Required",
+        confidence=0.0,
+        details=schemas.DiseaseBase(
+            name="Analysis Required",
+            severity="Unknown",
+            symptoms="Unable to analyze image. Please check API keys in Render dashboard.",
+            prevention="Add GOOGLE_API_KEY in Render Environment variables",
+            treatments=[
+                schemas.TreatmentBase(
+                    type="General",
+                    description="Please configure API keys for plant disease detection",
+                    cost_approx="Free"
+                )
+            ]
         )
+    )
+
+def _string_slots(node, slots):
+    """Collect (container, key) for every string value in a dumped result."""
+    items = node.items() if isinstance(node, dict) else enumerate(node)
+    for key, value in items:
+        if isinstance(value, str):
+            slots.append((node, key))
+        elif isinstance(value, (dict, list)):
+            _string_slots(value, slots)
+    return slots
+
+async def translate_result(result: schemas.PredictionResult, language: str) -> schemas.PredictionResult:
+    """Translate every string field (via the per-field cache); raises on failure."""
+    # Version and issue codes are identifiers, not text
+    data = result.model_dump(exclude={"model_version", "quality_issues", "source"})
+    slots = _string_slots(data, [])
+    translated = await groq_client.translate_strings_async(
+        [container[key] for container, key in slots], language
+    )
+    for (container, key), text in zip(slots, translated):
+        container[key] = text
+    return schemas.PredictionResult(**data, model_version=result.model_version,
+                                    quality_issues=result.quality_issues, source=result.source)
+
+async def diagnosis_events(upload: UploadBuffer, language: str = "en", stream: bool = False):
+    """
+    Full /predict pipeline for one image as (event, payload) stages: cache lookup,
+    provider analysis, schema mapping, translation and cache fill.
+    Yields ("result", PredictionResult) once, then ("translated", PredictionResult)
+    for non-English requests. With stream=True, Gemini's partial answer is also
+    surfaced as ("fields", {...}) events before the result. Provider failures raise.
+    """
+    language = language or "en"
 
-        # Translation Logic
-        if language and language != 'en':
+    # Same photo + language diagnosed recently? Skip every provider call.
+    cache_key = digest_key(upload.sha256, language)
+    cached = await diagnosis_cache.aget(cache_key)
+    if cached is not None:
+        print("Diagnosis cache hit")
+        yield "result", schemas.PredictionResult(**cached)
+        return
+
+    # Normalize once (orient, downscale, strip EXIF); every provider sees this copy
+    image = upload.image
+    try:
+        image, info = await asyncio.to_thread(image_preprocess.normalize_image, image)
+        print(f"Preprocessed image {info['original_size']} -> {info['size']}: "
+              f"{info['bytes_in']} -> {info['bytes_out']} bytes in {info['ms']} ms")
+    except Exception as e:
+        image_preprocess.stats.record_failure()
+        print(f"Image preprocessing skipped: {e}")
+
+    # Blurry, dark or leafless photo? Ask for a retake instead of spending provider calls on it.
+    gemini_result = None
+    if quality_gate.QUALITY_GATE:
+        try:
+            report = await asyncio.to_thread(quality_gate.check_image, image)
+            if not report["ok"]:
+                print(f"Quality gate: retake requested {report['reasons']} {report['metrics']}")
+                gemini_result = quality_gate.retake_result(report)
+        except Exception as e:
+            print(f"Quality check skipped: {e}")
+
+    # Near-duplicate of a past diagnosis? Reuse it instead of calling the providers.
+    embedding = symptoms = None
+    if gemini_result is None and similar_index is not None:
+        try:
+            embedding, symptoms = await asyncio.to_thread(image_signature, image)
+            stored = await asyncio.to_thread(similar_index.search, embedding, symptoms)
+            if stored is not None:
+                gemini_result = stored
+        except Exception as e:
+            print(f"Similar-image lookup skipped: {e}")
+
+    if gemini_result is None:
+        # AI DIAGNOSIS using Groq
+        print(f"Analyzing plant health with Groq AI (Language: {language})...")
+
+        try:
+            if stream:
+                async for event, payload in groq_client.analyze_plant_disease_stream(image):
+                    if event == "fields":
+                        yield "fields", payload
+                    else:
+                        gemini_result = payload
+            else:
+                gemini_result = await groq_client.analyze_plant_disease_async(image)
+        except Exception as e:
+            print(f"AI Diagnosis Failed: {e}")
+            raise HTTPException(status_code=503, detail=f"AI service unavailable: {str(e)}")
+
+        # Index real diagnoses only; the offline colour heuristic shouldn't stand in for a provider later
+        if (embedding is not None and gemini_result.get("confidence")
+                and gemini_result.get("source") not in HEURISTIC_SOURCES):
             try:
-                translated_text = groq_client.translate_text(
-                    text=final_result.model_dump_json(),
-                    target_language=language
-                )
-                import json
-                translated_json = json.loads(translated_text)
-                final_result = schemas.PredictionResult(**translated_json)
+                await asyncio.to_thread(similar_index.add, embedding, gemini_result, symptoms)
             except Exception as e:
-                print(f"Translation failed: {e}")
+                print(f"Similar-image index append failed: {e}")
 
-        return final_result
-        
+    final_result = build_prediction_result(gemini_result)
+
+    # Zero-confidence/error results and offline heuristics are never cached
+    cacheable = bool(gemini_result.get("confidence")) and gemini_result.get("source") not in HEURISTIC_SOURCES
+    if language == 'en':
+        if cacheable:
+            await diagnosis_cache.aset(cache_key, final_result.model_dump())
+        yield "result", final_result
+        return
+
+    # Translation Logic: the English result goes out first, the translation follows
+    yield "result", final_result
+    try:
+        translated = await translate_result(final_result, language)
+    except Exception as e:
+        print(f"Translation failed: {e}")
+        return
+    if cacheable:
+        await diagnosis_cache.aset(cache_key, translated.model_dump())
+    yield "translated", translated
+
+async def run_diagnosis(upload: UploadBuffer, language: str = "en") -> schemas.PredictionResult:
+    """The /predict pipeline (see diagnosis_events); returns the final, translated if possible, result."""
+    final_result = None
+    async for event, payload in diagnosis_events(upload, language):
+        if event != "fields":
+            final_result = payload
+    return final_result
+
+@app.post("/predict", response_model=schemas.PredictionResult)
+async def predict_disease(
+    file: UploadFile = File(...), 
+    language: str = Form("en")
+):
+    upload = None
+    try:
+        upload = await read_upload(file)
+        return await run_diagnosis(upload, language)
+    except HTTPException:
+        # 413 oversized upload / 503 no provider: the client needs the real status
+        raise
     except Exception as e:
         print(f"CRITICAL PREDICT FAULT: {str(e)}")
-        # Safe fallback so we NEVER return a 500 error that breaks CORS
-        return schemas.PredictionResult(
-            plant_name="Plant Detected",
-            disease_name="Analysis Required",
-            confidence=0.0,
-            details=schemas.DiseaseBase(
-                name="Analysis Required",
-                severity="Unknown",
-                symptoms="Unable to analyze image. Please check API keys in Render dashboard.",
-                prevention="Add GOOGLE_API_KEY in Render Environment variables",
-                treatments=[
-                    schemas.TreatmentBase(
-                        type="General",
-                        description="Please configure API keys for plant disease detection",
-                        cost_approx="Free"
-                    )
-                ]
-            )
-        )
+        return fallback_prediction_result()
     finally:
-        if os.path.exists(temp_file):
-            os.remove(temp_file)
+        if upload is not None:
+            upload.close()
+
+# Batch diagnosis: at most this many images per request / in flight per batch
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 64))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 8))
+
+@app.post("/predict/stream")
+async def predict_stream(
+    file: UploadFile = File(...),
+    language: str = Form("en")
+):
+    """
+    /predict as server-sent events, one per stage as it completes:
+    `fields` (plant/disease name and confidence as soon as Gemini has written them,
+    tagged with `provider`), `result` (full English result; `source` names the provider
+    that produced it), `translated` (non-English requests), then `done`.
+    Fields are only sent while their provider is the last one racing, but a weak
+    answer can still lose to the offline analyzer: discard any `fields` whose
+    `provider` differs from the result's `source`.
+    A failed diagnosis sends the fallback result with an `error` event instead.
+    """
+    upload = await read_upload(file)
+
+    def encode(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    async def stream():
+        try:
+            async for event, payload in diagnosis_events(upload, language, stream=True):
+                yield encode(event, payload if event == "fields" else payload.model_dump())
+        except Exception as e:
+            print(f"Streaming diagnosis failed: {e}")
+            detail = getattr(e, "detail", None) or str(e)
+            yield encode("error", {"detail": detail, "result": fallback_prediction_result().model_dump()})
+        finally:
+            upload.close()
+        yield encode("done", {"language": language or "en"})
+
+    # no-cache / no proxy buffering so each event reaches the phone as soon as it is sent
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    language: str = Form("en"),
+    format: str = Form("ndjson")
+):
+    """
+    Diagnose many images in one multipart request. Identical images are
+    diagnosed once; results stream back (NDJSON, or SSE with format=sse)
+    in completion order, each tagged with the index of its upload.
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_FILES} images per batch")
+
+    # Read every upload before streaming starts; group identical images by digest
+    uploads = {}
+    indices = {}
+    filenames = []
+    try:
+        for index, file in enumerate(files):
+            upload = await read_upload(file)
+            filenames.append(file.filename)
+            if upload.sha256 in uploads:
+                upload.close()
+            else:
+                uploads[upload.sha256] = upload
+            indices.setdefault(upload.sha256, []).append(index)
+    except BaseException:
+        for upload in uploads.values():
+            upload.close()
+        raise
+
+    limit = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def diagnose(digest):
+        async with limit:
+            try:
+                return digest, await run_diagnosis(uploads[digest], language), None
+            except Exception as e:
+                print(f"Batch item failed: {e}")
+                return digest, fallback_prediction_result(), str(e)
+            finally:
+                uploads[digest].close()
+
+    def encode(record):
+        if format == "sse":
+            return f"event: result\ndata: {json.dumps(record)}\n\n"
+        return json.dumps(record) + "\n"
+
+    async def stream():
+        tasks = [asyncio.create_task(diagnose(digest)) for digest in uploads]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                digest, result, error = await next_done
+                first = indices[digest][0]
+                for index in indices[digest]:
+                    record = {
+                        "index": index,
+                        "filename": filenames[index],
+                        "duplicate_of": first if index != first else None,
+                        "result": result.model_dump(),
+                    }
+                    if error:
+                        record["error"] = error
+                    yield encode(record)
+            summary = {"images": len(filenames), "unique": len(uploads)}
+            if format == "sse":
+                yield f"event: done\ndata: {json.dumps(summary)}\n\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            for upload in uploads.values():
+                upload.close()
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(stream(), media_type=media_type)
+
+async def _run_job(image: bytes, language: str) -> dict:
+    return (await run_diagnosis(UploadBuffer.from_bytes(image), language)).model_dump()
+
+# Background diagnosis jobs (POST returns immediately; clients poll or long-poll)
+job_queue = JobQueue(_run_job)
+
+@app.post("/predict/jobs", status_code=202)
+async def submit_prediction_job(
+    file: UploadFile = File(...),
+    language: str = Form("en")
+):
+    """Queue a diagnosis and return its job id straight away."""
+    upload = await read_upload(file)
+    try:
+        image = await asyncio.to_thread(upload.read_bytes) if upload.spilled else upload.data
+        job_id = await asyncio.to_thread(job_queue.submit, image, language or "en")
+    finally:
+        upload.close()
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/predict/jobs/{job_id}")
+async def get_prediction_job(job_id: str, wait: float = 0):
+    """Job status/result. `wait` (seconds, max 60) long-polls until the job finishes."""
+    job = await job_queue.wait(job_id, min(max(wait, 0), 60))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/metrics")
+def get_metrics():
+    """Counters for the diagnosis pipeline (cache hits = provider calls saved)."""
+    return {
+        "diagnosis_cache": diagnosis_cache.stats(),
+        "translation_cache": groq_client.translation_cache.stats(),
+        "gemini": groq_client.gemini_registry.stats(),
+        "http": http_client.stats(),
+        "local_inference": groq_client.local_inference_stats(),
+        "similar_index": similar_index.stats() if similar_index is not None else None,
+        "preprocess": image_preprocess.stats.snapshot(),
+        "quality_gate": quality_gate.stats.snapshot(),
+        "jobs": job_queue.stats(),
+    }
+
+@app.get("/ready")
+def ready():
+    """200 once the database schema is in place; per-component load times either way."""
+    is_ready = warmup.is_loaded("database")
+    body = {"ready": is_ready, "components": warmup.status()}
+    return body if is_ready else JSONResponse(body, status_code=503)
+
+@app.get("/health/providers")
+def provider_health():
+    """Circuit state, error rate and latency per provider tier (Plant.id, Gemini models, Overpass)."""
+    return provider_router.snapshot()
 
 # User Auth Routes
 @app.post("/auth/register", response_model=schemas.UserResponse)
@@ -324,7 +660,6 @@ app.include_router(places_service.router, prefix="/places", tags=["places"])
 # Test endpoint for OSM
 @app.get("/test-osm")
 def test_osm(lat: float = 13.0827, lon: float = 80.2707):
-    import requests
     overpass_url = "https://overpass-api.de/api/interpreter"
     query = f"""
     [out:json][timeout:25];
@@ -332,7 +667,7 @@ def test_osm(lat: float = 13.0827, lon: float = 80.2707):
     out count;
     """
     try:
-        resp = requests.post(overpass_url, data=query, headers={"Content-Type": "text/plain"}, timeout=30)
+        resp = http_client.post("overpass", overpass_url, data=query, headers={"Content-Type": "text/plain"}, timeout=30)
         return {"status": resp.status_code, "response": resp.text[:500]}
     except Exception as e:
         return {"error": str(e)}
@@ -1,77 +1,347 @@
+import io
+import os
 import json
+import time
+import shutil
+import tempfile
+import threading
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+from PIL import Image
 from pathlib import Path
 
-class DiseaseDetector:
-    def __init__(self):
-        self.model_path = Path("models/plant_disease_model.keras")
-        self.indices_path = Path("models/class_indices.json")
-        self.model = None
-        self.class_indices = None
-        self.class_names = []
-        
-        self._load_resources()
-
-    def _load_resources(self):
-        try:
-            if self.model_path.exists():
-                print(f"Loading model from {self.model_path}...")
-                self.model = load_model(self.model_path)
-                print("Model loaded successfully.")
-            else:
-                print(f"Warning: Model file not found at {self.model_path}. Inference will fail.")
-
-            if self.indices_path.exists():
-                with open(self.indices_path, "r") as f:
-                    self.class_indices = json.load(f)
-                    # Create a list of class names where index matches the list index
-                    # class_indices is {name: index}
-                    self.class_names = [None] * len(self.class_indices)
-                    for name, index in self.class_indices.items():
-                        self.class_names[index] = name
-                print(f"Loaded {len(self.class_names)} class indices.")
-            else:
-                print(f"Warning: Class indices file not found at {self.indices_path}.")
-                
-        except Exception as e:
-            print(f"Error loading resources: {e}")
+from . import warmup
+from .inference_batcher import MicroBatcher
 
-    def predict(self, image_path):
-        if not self.model or not self.class_names:
-            # Try reloading if missing (maybe training just finished)
-            self._load_resources()
-            if not self.model or not self.class_names:
-                return {"label": "Error: Model not loaded", "confidence": 0.0}
+IMG_SIZE = (160, 160)
+# "keras", "tflite", or "auto" (TFLite when the quantized model has been exported)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "auto")
+
+# Versioned layout: models/versions/<version>/{model file, class_indices.json}
+MODELS_DIR = Path(os.getenv("MODELS_DIR", "models"))
+KERAS_FILE = "plant_disease_model.keras"
+TFLITE_FILE = "plant_disease_model_int8.tflite"
+INDICES_FILE = "class_indices.json"
+# Pin a version directory name; empty = newest
+MODEL_VERSION = os.getenv("MODEL_VERSION", "")
+# Seconds between checks for a newly published version (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 30))
+
+def load_image_array(source):
+    """
+    Load one image (path or bytes-like) into a (160, 160, 3) float32 array of raw
+    0-255 pixels, bilinear-resized like image_dataset_from_directory in train.py.
+    No scaling here: the trained model applies mobilenet_v2.preprocess_input itself.
+    """
+    if not isinstance(source, (str, os.PathLike)):
+        source = io.BytesIO(bytes(source))
+    with Image.open(source) as img:
+        img = img.convert("RGB").resize(IMG_SIZE, Image.BILINEAR)
+        return np.asarray(img, dtype=np.float32)
+
+class KerasBackend:
+    """Full TensorFlow/Keras model."""
+    name = "keras"
+
+    def __init__(self, model_path):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(model_path)
+
+    def predict(self, batch):
+        # Direct call skips model.predict()'s per-call dataset/callback setup
+        return np.asarray(self.model(batch, training=False))
+
+def _tflite_interpreter_class():
+    """Lightest available TFLite runtime: tflite-runtime, LiteRT, then full TensorFlow."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+class TFLiteBackend:
+    """int8-quantized TFLite model (see export_model.py)."""
+    name = "tflite"
 
+    def __init__(self, model_path, num_threads=None):
+        Interpreter = _tflite_interpreter_class()
+        self.interpreter = Interpreter(model_path=str(model_path),
+                                       num_threads=num_threads or os.cpu_count())
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # The interpreter holds mutable tensor buffers; one batch at a time
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self._input["index"], list(batch.shape))
+                self.interpreter.allocate_tensors()
+                self._input = self.interpreter.get_input_details()[0]
+                self._output = self.interpreter.get_output_details()[0]
+                self._batch_size = batch.shape[0]
+
+            dtype = self._input["dtype"]
+            if dtype != np.float32:
+                scale, zero_point = self._input["quantization"]
+                info = np.iinfo(dtype)
+                batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+            self.interpreter.set_tensor(self._input["index"], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self._output["index"])
+
+            if output.dtype != np.float32:
+                scale, zero_point = self._output["quantization"]
+                output = (output.astype(np.float32) - zero_point) * scale
+            return output
+
+def _version_files(version_dir):
+    """(model_file, class_indices_file) for a version directory, or None if incomplete."""
+    indices = version_dir / INDICES_FILE
+    if not indices.exists():
+        return None
+    tflite, keras = version_dir / TFLITE_FILE, version_dir / KERAS_FILE
+    use_tflite = MODEL_BACKEND == "tflite" or (MODEL_BACKEND == "auto" and tflite.exists())
+    if use_tflite and tflite.exists():
+        return tflite, indices
+    if keras.exists():
+        return keras, indices
+    return None
+
+def latest_version(models_dir=MODELS_DIR):
+    """
+    (version, directory) to serve: MODEL_VERSION if pinned, else the newest complete
+    directory under models/versions/, else the flat models/ layout as "legacy".
+    """
+    versions_dir = models_dir / "versions"
+    if versions_dir.is_dir():
+        # Names sort chronologically; dot-prefixed directories are still being written
+        candidates = sorted((p for p in versions_dir.iterdir()
+                             if p.is_dir() and not p.name.startswith(".")), reverse=True)
+        if MODEL_VERSION:
+            candidates = [p for p in candidates if p.name == MODEL_VERSION]
+        for version_dir in candidates:
+            if _version_files(version_dir):
+                return version_dir.name, version_dir
+    if not MODEL_VERSION and _version_files(models_dir):
+        return "legacy", models_dir
+    return None, None
+
+def publish_version(files, models_dir=MODELS_DIR, version=None):
+    """
+    Copy a trained model and its class indices into a new models/versions/<version>/
+    directory. The directory is staged under a dot-prefixed name and renamed into
+    place, so a watching DiseaseDetector never sees a half-written version.
+    A name already taken (two publishes in one second) gets a -01, -02... suffix,
+    which still sorts after it.
+    """
+    base = version or time.strftime("%Y%m%d-%H%M%S")
+    versions_dir = models_dir / "versions"
+    versions_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{base}.", suffix=".staging", dir=versions_dir))
+    for path in files:
+        shutil.copy2(path, staging / Path(path).name)
+    for attempt in range(100):
+        version = base if attempt == 0 else f"{base}-{attempt:02d}"
+        target = versions_dir / version
+        if target.exists():
+            continue
         try:
-            # Preprocess image
-            img = image.load_img(image_path, target_size=(160, 160))
-            img_array = image.img_to_array(img)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = tf.keras.applications.mobilenet_v2.preprocess_input(img_array)
-
-            # Predict
-            predictions = self.model.predict(img_array)
-            predicted_index = np.argmax(predictions[0])
-            confidence = float(predictions[0][predicted_index])
-            predicted_label = self.class_names[predicted_index]
-
-            if confidence < 0.4:
-                return {
-                    "label": "Unknown",
-                    "confidence": confidence,
-                    "original_label": predicted_label
-                }
+            os.rename(staging, target)
+            break
+        except OSError:
+            # Lost a race with another publisher for this name
+            if not target.exists():
+                raise
+    else:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise RuntimeError(f"No free version name for {base} under {versions_dir}")
+    print(f"Published model version {version} to {target}")
+    return target
+
+class ModelVersion:
+    """One loaded, immutable model version: backend plus the class names it was trained with."""
+
+    def __init__(self, version, version_dir):
+        model_file, indices_file = _version_files(version_dir)
+        self.version = version
+        self.path = model_file
+        print(f"Loading model version {version} from {model_file}...")
+        backend_cls = TFLiteBackend if model_file.suffix == ".tflite" else KerasBackend
+        self.backend = backend_cls(model_file)
+        with open(indices_file, "r") as f:
+            class_indices = json.load(f)
+        # Create a list of class names where index matches the list index
+        # class_indices is {name: index}
+        self.class_names = [None] * len(class_indices)
+        for name, index in class_indices.items():
+            self.class_names[index] = name
+        self.loaded_at = time.time()
+        print(f"Model {version} loaded ({self.backend.name} backend, {len(self.class_names)} classes).")
+
+class DiseaseDetector:
+    """
+    Serves the newest model version. New versions are loaded by `refresh()` (called
+    from the watcher thread, never from a request) and swapped in with a single
+    reference assignment; a batch that already picked up the old version finishes on it.
+    """
+
+    def __init__(self, models_dir=MODELS_DIR):
+        self.models_dir = Path(models_dir)
+        self.active = None
+        self.swaps = 0
+        self.last_error = None
+        self._refresh_lock = threading.Lock()
+        self._watcher = None
+        self.refresh()
 
+    @property
+    def model(self):
+        active = self.active
+        return active.backend if active else None
+
+    @property
+    def class_names(self):
+        active = self.active
+        return active.class_names if active else []
+
+    @property
+    def backend(self):
+        active = self.active
+        return active.backend.name if active else None
+
+    @property
+    def version(self):
+        active = self.active
+        return active.version if active else None
+
+    def refresh(self):
+        """Load and swap in the newest version if it differs from the active one; True if swapped."""
+        with self._refresh_lock:
+            version, version_dir = latest_version(self.models_dir)
+            if version is None:
+                if self.active is None:
+                    print(f"Warning: No model found under {self.models_dir}. Inference will fail.")
+                return False
+            if self.active is not None and version == self.active.version:
+                return False
+            try:
+                loaded = ModelVersion(version, version_dir)
+            except Exception as e:
+                # Keep serving the current version; retry on the next poll
+                self.last_error = f"{version}: {e}"
+                print(f"Error loading model version {version}: {e}")
+                return False
+            previous = self.active
+            self.active = loaded
+            self.last_error = None
+            if previous is not None:
+                self.swaps += 1
+                print(f"Model swapped: {previous.version} -> {version}")
+            return True
+
+    def start_watcher(self, interval=MODEL_WATCH_INTERVAL):
+        """Poll for new versions in a daemon thread every `interval` seconds."""
+        if self._watcher is not None or interval <= 0:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(f"Model watcher error: {e}")
+
+        self._watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+        self._watcher.start()
+
+    def info(self):
+        active = self.active
+        return {
+            "version": active.version if active else None,
+            "backend": active.backend.name if active else None,
+            "path": str(active.path) if active else None,
+            "loaded_at": active.loaded_at if active else None,
+            "swaps": self.swaps,
+            "last_error": self.last_error,
+        }
+
+    def preprocess(self, image_path):
+        """Load one image (path or bytes-like) into the model's (160, 160, 3) 0-255 input."""
+        return load_image_array(image_path)
+
+    def _decode(self, probabilities, active):
+        predicted_index = int(np.argmax(probabilities))
+        confidence = float(probabilities[predicted_index])
+        predicted_label = active.class_names[predicted_index]
+
+        if confidence < 0.4:
             return {
-                "label": predicted_label,
-                "confidence": confidence
+                "label": "Unknown",
+                "confidence": confidence,
+                "original_label": predicted_label,
+                "model_version": active.version
             }
+
+        return {
+            "label": predicted_label,
+            "confidence": confidence,
+            "model_version": active.version
+        }
+
+    def predict_batch(self, arrays):
+        """One forward pass over a list of preprocessed arrays; one result dict per array."""
+        # Read the pointer once so the whole batch runs on one version even if a swap lands mid-way
+        active = self.active
+        if active is None:
+            return [{"label": "Error: Model not loaded", "confidence": 0.0} for _ in arrays]
+
+        try:
+            batch = np.stack(arrays).astype(np.float32)
+            predictions = active.backend.predict(batch)
+            return [self._decode(row, active) for row in predictions]
+        except Exception as e:
+            print(f"Prediction error: {e}")
+            return [{"label": "Error: Prediction failed", "confidence": 0.0} for _ in arrays]
+
+    def predict(self, image_path):
+        """`image_path` may be a file path or an in-memory (bytes-like) image."""
+        try:
+            img_array = self.preprocess(image_path)
         except Exception as e:
             print(f"Prediction error: {e}")
             return {"label": "Error: Prediction failed", "confidence": 0.0}
+        return self.predict_batch([img_array])[0]
+
+# Created on first use (or by the warm-up task), not at import time
+detector = None
+# Concurrent async callers share batched forward passes
+inference_batcher = None
+_init_lock = threading.Lock()
+
+def get_detector():
+    global detector
+    if detector is None:
+        with _init_lock:
+            if detector is None:
+                with warmup.timed("local_model"):
+                    detector = DiseaseDetector()
+                if detector.model is None:
+                    warmup.record("local_model", 0.0, "model file not found")
+                detector.start_watcher()
+    return detector
 
-detector = DiseaseDetector()
+def get_inference_batcher():
+    global inference_batcher
+    if inference_batcher is None:
+        inference_batcher = MicroBatcher(get_detector().predict_batch)
+    return inference_batcher
@@ -1,14 +1,76 @@
+"""
+Organize the raw datasets into datasets/processed_v2/{train,val,test}/<class>.
+
+Incremental: datasets/processed_v2/manifest.json records every source image
+(path, size, mtime, sha256, class, split, destination). Re-runs only hash files
+whose size/mtime changed and only add, remove or move the images that changed.
+An image keeps the split the manifest records for it; new images take their
+duplicate cluster's split, which is derived from the content hash of the first
+image ever recorded for that cluster (its split_key). Adding, removing or
+duplicating other images never moves an image between train and test.
+
+Before splitting, duplicates across all sources collapse to one canonical image
+per class: byte-identical copies (sha256) always, and re-encoded or resized
+copies when their 256-bit DCT hash (pHash) is within a few bits of a canonical
+image of the same class. Every copy of an image lands in the same split. Hashes
+are computed in worker processes and kept in datasets/hash_index.db;
+dedup_report.json lists duplicates per class. Processed files are named after
+their content hash and created on a thread pool as copies, hardlinks (default),
+reflinks or symlinks.
+
+Run from the project root:
+    python backend/organize_dataset.py           # incremental
+    python backend/organize_dataset.py --full    # wipe processed_v2 and rebuild
+    python backend/organize_dataset.py --mode symlink
+"""
+import io
 import os
+import json
+import time
 import shutil
-import random
+import sqlite3
+import hashlib
+import argparse
+import threading
+import numpy as np
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Configuration
 RAW_DATA_DIR = Path("datasets/raw")
 PROCESSED_DATA_DIR = Path("datasets/processed_v2")
+MANIFEST_PATH = PROCESSED_DATA_DIR / "manifest.json"
+DEDUP_REPORT_PATH = PROCESSED_DATA_DIR / "dedup_report.json"
+# Survives --full rebuilds: re-hashing tens of thousands of images is the slow part
+HASH_INDEX_PATH = Path(os.getenv("HASH_INDEX_PATH", "datasets/hash_index.db"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+# Max differing bits (of 256) between pHashes for a re-encode of the same picture;
+# JPEG re-encodes/resizes measure <= 10, distinct leaves on plain backgrounds >= 26.
+# -1 disables (exact duplicates only)
+PHASH_DISTANCE = int(os.getenv("DEDUP_PHASH_DISTANCE", 12))
+PHASH_SIZE = 64   # grey thumbnail the DCT runs on
+PHASH_FREQS = 16  # 16x16 lowest frequencies -> 256 bits
 SPLIT_RATIOS = {"train": 0.8, "val": 0.1, "test": 0.1}
-SEED = 42
+SEED = 42  # salts the split hash; changing it reshuffles every image
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+# How processed images are materialized: copy, hardlink, reflink or symlink.
+# hardlink/reflink/symlink don't duplicate image bytes on disk.
+LINK_MODES = ("copy", "hardlink", "reflink", "symlink")
+LINK_MODE = os.getenv("ORGANIZE_LINK_MODE", "hardlink")
+ORGANIZE_WORKERS = int(os.getenv("ORGANIZE_WORKERS", min(32, (os.cpu_count() or 1) * 4)))
+HASH_NAME_CHARS = 16
+FICLONE = 0x40049409  # linux/fs.h
+
+_hardlink_supported = None
+_reflink_supported = None
+_fallback_lock = threading.Lock()
 
 # Specific Source Directories to scan
 # We list the exact paths where class folders are located
@@ -90,77 +152,405 @@ def normalize_class_name(folder_name):
     # Better to just return it cleaned up if not in mapping
     return folder_name.replace(" ", "_").replace("__", "_")
 
-def organize_dataset():
-    random.seed(SEED)
-    
-    # Create output directories
-    if PROCESSED_DATA_DIR.exists():
-        print(f"Removing existing {PROCESSED_DATA_DIR}...")
-        shutil.rmtree(PROCESSED_DATA_DIR)
-    
-    for split in SPLIT_RATIOS:
-        (PROCESSED_DATA_DIR / split).mkdir(parents=True, exist_ok=True)
-
-    print("Scanning datasets...")
-    class_images = defaultdict(list)
-    
+def scan_sources():
+    """(source path, normalized class) for every image under SOURCE_DIRS."""
+    found = []
     for source_dir in SOURCE_DIRS:
         if not source_dir.exists():
             print(f"Skipping missing directory: {source_dir}")
             continue
-            
+
         print(f"Scanning {source_dir}...")
-        for entry in os.scandir(source_dir):
+        for entry in sorted(os.scandir(source_dir), key=lambda e: e.name):
             if entry.is_dir():
                 class_name = entry.name
-                
+
                 # Skip container folders that are not classes
                 if class_name in ["PlantVillage", "Original Images", "Augmented images"]:
                     continue
-                    
+
                 normalized_name = normalize_class_name(class_name)
-                
-                # Collect images
+
+                # Collect images (sorted, so the first copy of a duplicate - the one
+                # kept - doesn't depend on directory order)
                 images = []
-                for root, _, files in os.walk(entry.path):
-                    for file in files:
-                        if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
+                for root, dirs, files in os.walk(entry.path):
+                    dirs.sort()
+                    for file in sorted(files):
+                        if file.lower().endswith(IMAGE_EXTENSIONS):
                             images.append(Path(root) / file)
-                
+
                 if images:
-                    class_images[normalized_name].extend(images)
+                    found.extend((path, normalized_name) for path in images)
                     print(f"  Found {len(images)} images for {normalized_name} (from {class_name})")
+    return found
 
-    print(f"\nTotal classes found: {len(class_images)}")
-    
-    total_processed = 0
-    for class_name, images in class_images.items():
-        # Shuffle
-        random.shuffle(images)
-        
-        # Split
-        n_total = len(images)
-        n_train = int(n_total * SPLIT_RATIOS["train"])
-        n_val = int(n_total * SPLIT_RATIOS["val"])
-        
-        splits = {
-            "train": images[:n_train],
-            "val": images[n_train:n_train+n_val],
-            "test": images[n_train+n_val:]
-        }
-        
-        for split, split_images in splits.items():
-            split_dir = PROCESSED_DATA_DIR / split / class_name
-            split_dir.mkdir(parents=True, exist_ok=True)
-            
-            for img_path in split_images:
-                dest_path = split_dir / img_path.name
-                if dest_path.exists():
-                    dest_path = split_dir / f"{img_path.stem}_{random.randint(1000,9999)}{img_path.suffix}"
-                shutil.copy2(img_path, dest_path)
-                total_processed += 1
-                
-    print(f"\nDone! Processed {total_processed} images into {PROCESSED_DATA_DIR}")
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def dest_name(sha256, source):
+    """Deterministic file name from the content hash; identical bytes share one name."""
+    return f"{sha256[:HASH_NAME_CHARS]}{source.suffix.lower()}"
+
+def _reflink(source, dest):
+    """Copy-on-write clone (Btrfs/XFS/APFS-style); plain copy where unsupported."""
+    global _reflink_supported
+    if _reflink_supported is not False and fcntl is not None:
+        try:
+            with open(source, "rb") as src, open(dest, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            _reflink_supported = True
+            return
+        except OSError:
+            with _fallback_lock:
+                if _reflink_supported is None:
+                    print("Reflinks not supported on this filesystem; copying instead")
+                _reflink_supported = False
+    shutil.copyfile(source, dest)
+
+def _hardlink(source, dest):
+    global _hardlink_supported
+    if _hardlink_supported is not False:
+        try:
+            os.link(source, dest)
+            return
+        except OSError as e:
+            # Cross-device or unsupported: fall back once, don't retry per file
+            with _fallback_lock:
+                if _hardlink_supported is None:
+                    print(f"Hardlinks unavailable ({e}); copying instead")
+                _hardlink_supported = False
+    shutil.copyfile(source, dest)
+
+def materialize(source, dest, mode=LINK_MODE):
+    """Place one source image at dest (replacing whatever is there) using `mode`."""
+    if mode in ("hardlink", "symlink"):
+        # Link creation is atomic: a crash can't leave a half-written file behind
+        if os.path.lexists(dest):
+            os.remove(dest)
+        if mode == "hardlink":
+            _hardlink(source, dest)
+        else:
+            os.symlink(os.path.abspath(source), dest)
+        return
+    # Copies go through a temp name so an interrupted run never leaves a truncated
+    # file under a content-hash name (which the next run would trust)
+    tmp = dest.with_name(dest.name + ".tmp")
+    if mode == "reflink":
+        _reflink(source, tmp)
+    else:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, dest)
+
+def run_parallel(fn, items, workers=ORGANIZE_WORKERS):
+    """fn over items on a thread pool (file I/O and hashing release the GIL)."""
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, items))
+
+def assign_split(sha256):
+    """Stable split from the content hash: same bytes, same split, on every run."""
+    point = int(hashlib.sha256(f"{SEED}:{sha256}".encode()).hexdigest()[:8], 16) / 0x100000000
+    cumulative = 0.0
+    for split, ratio in SPLIT_RATIOS.items():
+        cumulative += ratio
+        if point < cumulative:
+            return split
+    return split
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+_DCT = _dct_matrix(PHASH_SIZE)[:PHASH_FREQS]
+
+def _hash_image(path):
+    """(sha256, pHash hex) of one file; pHash is None when the image can't be decoded."""
+    with open(path, "rb") as f:
+        data = f.read()
+    sha256 = hashlib.sha256(data).hexdigest()
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("L", (PHASH_SIZE * 2, PHASH_SIZE * 2))
+            pixels = np.asarray(img.convert("L").resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=np.float64)
+    except Exception:
+        return sha256, None
+    # Low-frequency DCT coefficients above/below their median: unlike a pixel-gradient
+    # hash, flat backgrounds and JPEG noise barely move them
+    coefficients = (_DCT @ pixels @ _DCT.T).ravel()
+    bits = coefficients > np.median(coefficients[1:])
+    return sha256, f"{int(''.join('1' if bit else '0' for bit in bits), 2):064x}"
+
+def hash_images(paths, workers=HASH_WORKERS):
+    """
+    {path: {"size", "mtime_ns", "sha256", "phash"}} for every path. Files whose
+    size/mtime match the on-disk index aren't read; the rest are hashed in a
+    process pool (decoding for the pHash is CPU-bound). Returns (hashes, hashed count).
+    """
+    HASH_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(HASH_INDEX_PATH)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(hashes)")]
+    if columns and "phash" not in columns:
+        print(f"Hash index {HASH_INDEX_PATH} predates pHash; re-hashing every image once")
+        conn.execute("DROP TABLE hashes")
+    conn.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                 "mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL, phash TEXT)")
+    known = {row[0]: row[1:] for row in conn.execute("SELECT path, size, mtime_ns, sha256, phash FROM hashes")}
+
+    hashes = {}
+    stale = []
+    for path, stat in zip(paths, run_parallel(os.stat, paths)):
+        row = known.get(path)
+        hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            hashes[path].update(sha256=row[2], phash=row[3])
+        else:
+            stale.append(path)
+
+    if stale:
+        print(f"Hashing {len(stale)} new or changed images with {workers} processes...")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_hash_image, stale, chunksize=64))
+        for path, (sha256, phash) in zip(stale, results):
+            hashes[path].update(sha256=sha256, phash=phash)
+        conn.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                         [(path, hashes[path]["size"], hashes[path]["mtime_ns"],
+                           hashes[path]["sha256"], hashes[path]["phash"]) for path in stale])
+    gone = set(known) - set(hashes)
+    conn.executemany("DELETE FROM hashes WHERE path = ?", [(path,) for path in gone])
+    conn.commit()
+    conn.close()
+    return hashes, len(stale)
+
+def cluster_split(members, entries, previous):
+    """
+    Set "split" and "split_key" on every member of one duplicate cluster (in scan
+    order). Images the manifest already has, with unchanged bytes, keep their
+    recorded split. New members join the cluster's split: that of its first
+    recorded member, or for a brand-new cluster assign_split() of its first image.
+    """
+    known = [key for key in members
+             if key in previous and previous[key].get("split") and previous[key]["sha256"] == entries[key]["sha256"]]
+    if known:
+        first = previous[known[0]]
+        split_key, split = first.get("split_key", first["sha256"]), first["split"]
+    else:
+        split_key = entries[members[0]]["sha256"]
+        split = assign_split(split_key)
+    for key in members:
+        if key in known:
+            entries[key]["split"] = previous[key]["split"]
+            entries[key]["split_key"] = previous[key].get("split_key", previous[key]["sha256"])
+        else:
+            entries[key]["split"] = split
+            entries[key]["split_key"] = split_key
+
+def find_duplicates(entries, previous=None, distance=PHASH_DISTANCE):
+    """
+    Group entries into duplicate clusters, each founded by one canonical image.
+    Byte-identical images (same sha256) always share a cluster, whatever their
+    class. Any other image joins the cluster whose kept image of the same class
+    is closest, if within `distance` pHash bits; it is only ever compared with
+    kept images, so a chain of near matches can't pull distinct pictures into
+    one cluster. Images the last manifest kept (`previous` entries) are placed
+    first so they stay kept.
+
+    Sets "split" on every entry (see cluster_split) and "duplicate_of" on every
+    copy not kept for its class: {"of": kept key, "kind": "exact" | "perceptual"},
+    where exact means its bytes match an earlier image of the class in the
+    cluster. Returns clusters that span several classes.
+    """
+    previous = previous or {}
+    order = {key: i for i, key in enumerate(entries)}
+    def was_kept(key):
+        old = previous.get(key)
+        return bool(old) and old["sha256"] == entries[key]["sha256"] and "duplicate_of" not in old
+    keys = sorted(entries, key=lambda key: (not was_kept(key), order[key]))
+
+    groups = {}  # sha256 -> keys with those bytes
+    for key in keys:
+        groups.setdefault(entries[key]["sha256"], []).append(key)
+
+    clusters = []  # member keys, founding group first
+    kept = []      # per cluster: {class: kept key}
+    bands = max(distance + 1, 1)
+    width = -(-256 // bands)
+    mask = (1 << width) - 1
+    # Pigeonhole: hashes within `distance` bits agree exactly on at least one of
+    # distance + 1 bands, so only kept images sharing a band value are compared
+    index = defaultdict(list)  # (class, band, value) -> [(cluster, pHash)]
+
+    def match(key):
+        if distance < 0 or not entries[key]["phash"]:
+            return None
+        value = int(entries[key]["phash"], 16)
+        best = None
+        for band in range(bands):
+            for cluster, other in index[(entries[key]["class"], band, (value >> (band * width)) & mask)]:
+                bits = bin(value ^ other).count("1")
+                if bits <= distance and (best is None or bits < best[0]):
+                    best = (bits, cluster)
+        return best[1] if best else None
+
+    for members in groups.values():
+        cluster = match(members[0])
+        if cluster is None:
+            cluster = len(clusters)
+            clusters.append([])
+            kept.append({})
+        clusters[cluster].extend(members)
+        for key in members:
+            class_name = entries[key]["class"]
+            if class_name in kept[cluster]:
+                continue
+            kept[cluster][class_name] = key
+            if entries[key]["phash"] and distance >= 0:
+                value = int(entries[key]["phash"], 16)
+                for band in range(bands):
+                    index[(class_name, band, (value >> (band * width)) & mask)].append((cluster, value))
+
+    cross_class = []
+    for members, keep in zip(clusters, kept):
+        # Split order is scan order, so a new cluster is keyed on its first scanned image
+        cluster_split(sorted(members, key=order.get), entries, previous)
+        seen = defaultdict(set)  # class -> sha256s already in the cluster
+        for key in members:
+            entry = entries[key]
+            if keep[entry["class"]] != key:
+                kind = "exact" if entry["sha256"] in seen[entry["class"]] else "perceptual"
+                entry["duplicate_of"] = {"of": keep[entry["class"]], "kind": kind}
+            seen[entry["class"]].add(entry["sha256"])
+        if len(keep) > 1:
+            cross_class.append({"classes": sorted(keep), "images": sorted(members, key=order.get)})
+    return cross_class
+
+def dedup_report(entries, cross_class):
+    """Per-class counts of source images, kept images and exact/perceptual duplicates."""
+    classes = {}
+    for entry in entries.values():
+        row = classes.setdefault(entry["class"], {"images": 0, "kept": 0, "exact": 0, "perceptual": 0})
+        row["images"] += 1
+        duplicate = entry.get("duplicate_of")
+        row[duplicate["kind"] if duplicate else "kept"] += 1
+    return {"phash_distance": PHASH_DISTANCE, "classes": dict(sorted(classes.items())),
+            "cross_class_clusters": len(cross_class), "cross_class": cross_class}
+
+def print_dedup_report(report):
+    print(f"\n{'class':<36} {'images':>7} {'kept':>7} {'exact':>7} {'percept':>7}")
+    for name, row in report["classes"].items():
+        if row["exact"] or row["perceptual"]:
+            print(f"{name:<36} {row['images']:>7} {row['kept']:>7} {row['exact']:>7} {row['perceptual']:>7}")
+    totals = {field: sum(row[field] for row in report["classes"].values())
+              for field in ("images", "kept", "exact", "perceptual")}
+    print(f"{'total':<36} {totals['images']:>7} {totals['kept']:>7} {totals['exact']:>7} {totals['perceptual']:>7}")
+    if report["cross_class_clusters"]:
+        print(f"{report['cross_class_clusters']} duplicate clusters span several classes "
+              f"(kept once per class, same split); see {DEDUP_REPORT_PATH}")
+
+def load_manifest():
+    if not MANIFEST_PATH.exists():
+        return None
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Ignoring unreadable manifest {MANIFEST_PATH}: {e}")
+        return None
+
+def save_manifest(entries, mode):
+    tmp_path = MANIFEST_PATH.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"seed": SEED, "split_ratios": SPLIT_RATIOS, "mode": mode, "entries": entries}, f)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def organize_dataset(full=False, mode=LINK_MODE, workers=ORGANIZE_WORKERS):
+    started = time.perf_counter()
+    manifest = None if full else load_manifest()
+    if manifest is None and PROCESSED_DATA_DIR.exists():
+        # No record of what's in there (or a forced rebuild): start clean once
+        print(f"Removing existing {PROCESSED_DATA_DIR}...")
+        shutil.rmtree(PROCESSED_DATA_DIR)
+    previous = manifest["entries"] if manifest else {}
+    # Switching modes (e.g. copy -> hardlink) re-materializes every file
+    remake = manifest is not None and manifest.get("mode", "copy") != mode
+
+    for split in SPLIT_RATIOS:
+        (PROCESSED_DATA_DIR / split).mkdir(parents=True, exist_ok=True)
+
+    print("Scanning datasets...")
+    sources = scan_sources()
+    print(f"\nTotal classes found: {len(set(c for _, c in sources))}")
+
+    # Hash only files whose size or mtime changed since they were last indexed
+    hashes, hashed = hash_images([str(path) for path, _ in sources])
+    entries = {str(path): dict(hashes[str(path)], **{"class": class_name}) for path, class_name in sources}
+
+    # Collapse duplicates before splitting; only canonical images get a file
+    cross_class = find_duplicates(entries, previous)
+    report = dedup_report(entries, cross_class)
+
+    # Destination = split/class/<content hash>
+    wanted = {}
+    for key, entry in entries.items():
+        if "duplicate_of" in entry:
+            continue
+        dest = PROCESSED_DATA_DIR / entry["split"] / entry["class"] / dest_name(entry["sha256"], Path(key))
+        entry["dest"] = str(dest)
+        wanted.setdefault(entry["dest"], key)
+
+    # Files from the last run nobody wants any more; same-hash ones can be moved instead of re-created
+    orphans = {}
+    for old in previous.values():
+        if old.get("dest") and old["dest"] not in wanted and os.path.lexists(old["dest"]):
+            orphans.setdefault(old["sha256"], set()).add(old["dest"])
+
+    counts = {"unchanged": 0, "added": 0, "moved": 0, "removed": 0}
+    tasks = []
+    for dest, key in wanted.items():
+        if not remake and os.path.exists(dest):
+            counts["unchanged"] += 1
+            continue
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Renaming a leftover copy is cheaper than re-copying; links are just re-created
+        # (a hardlink/symlink may no longer hold the bytes it was made from)
+        candidates = orphans.get(entries[key]["sha256"]) if mode in ("copy", "reflink") else None
+        if candidates and not remake:
+            os.replace(candidates.pop(), dest)
+            counts["moved"] += 1
+            continue
+        tasks.append((key, Path(dest)))
+
+    run_parallel(lambda task: materialize(task[0], task[1], mode), tasks, workers)
+    counts["added"] = len(tasks)
+
+    for paths in orphans.values():
+        for path in paths:
+            os.remove(path)
+            counts["removed"] += 1
+
+    # Drop class folders emptied by removals/moves
+    for split in SPLIT_RATIOS:
+        for class_dir in (PROCESSED_DATA_DIR / split).iterdir():
+            if class_dir.is_dir() and not any(class_dir.iterdir()):
+                class_dir.rmdir()
+
+    save_manifest(entries, mode)
+    with open(DEDUP_REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=4)
+    print_dedup_report(report)
+    split_counts = {split: sum(entries[key]["split"] == split for key in wanted.values()) for split in SPLIT_RATIOS}
+    print(f"\nDone in {time.perf_counter() - started:.1f}s ({mode}): {len(wanted)} images in {PROCESSED_DATA_DIR} {split_counts}")
+    print(f"  hashed {hashed}, " + ", ".join(f"{name} {count}" for name, count in counts.items()))
+    return counts
 
 if __name__ == "__main__":
-    organize_dataset()
+    parser = argparse.ArgumentParser(description="Organize datasets/raw into train/val/test splits.")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and rebuild from scratch")
+    parser.add_argument("--mode", choices=LINK_MODES, default=LINK_MODE,
+                        help="how processed images are created (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=ORGANIZE_WORKERS)
+    args = parser.parse_args()
+    organize_dataset(full=args.full, mode=args.mode, workers=args.workers)
@@ -1,19 +1,29 @@
 import os
-import requests
 import json
 import time
 from fastapi import APIRouter, Query
 from typing import Optional, List, Dict, Any
 
+from . import http_client, warmup
+from .provider_router import router as provider_router
+
 router = APIRouter()
 
-# Try to import groq for AI-powered features
-try:
-    from groq import Groq
-    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-    groq_client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
-except:
-    groq_client = None
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+_groq_client = None
+
+def get_groq_client():
+    """Groq client for AI-powered price lookups, built on first use (None if unavailable)."""
+    global _groq_client
+    if _groq_client is None and GROQ_API_KEY:
+        # Try to import groq for AI-powered features
+        try:
+            with warmup.timed("groq_sdk"):
+                from groq import Groq
+                _groq_client = Groq(api_key=GROQ_API_KEY)
+        except Exception as e:
+            print(f"Groq client unavailable: {e}")
+    return _groq_client
 
 # Multiple Overpass API endpoints for redundancy
 OVERPASS_ENDPOINTS = [
@@ -23,18 +33,26 @@ OVERPASS_ENDPOINTS = [
 ]
 
 def query_overpass(query: str, timeout: int = 30) -> Optional[dict]:
-    """Try multiple Overpass API endpoints with retries."""
+    """Try multiple Overpass API endpoints with retries, skipping ones with an open circuit."""
     for endpoint in OVERPASS_ENDPOINTS:
+        breaker = provider_router.breaker(f"overpass:{endpoint}")
+        if not breaker.allow():
+            continue
+        started = time.perf_counter()
         try:
-            response = requests.post(
+            response = http_client.post(
+                "overpass",
                 endpoint,
                 data=query,
                 headers={"Content-Type": "text/plain"},
                 timeout=timeout
             )
             if response.status_code == 200:
+                breaker.record_success(time.perf_counter() - started)
                 return response.json()
+            breaker.record_failure()
         except Exception as e:
+            breaker.record_failure()
             print(f"Overpass error on {endpoint}: {e}")
             time.sleep(1)
     return None
@@ -255,6 +273,7 @@ def get_live_price(comparison: str = Query(..., description="Crop/commodity name
     """
     Get live price using Groq AI to search current market rates.
     """
+    groq_client = get_groq_client()
     if not groq_client:
         return {"error": "GROQ_API_KEY not configured", "price": None, "source": "AI"}
     
@@ -284,6 +303,7 @@ def get_fertilizer_price(fertilizer: str = Query(..., description="Fertilizer na
     """
     Get fertilizer prices using Groq AI.
     """
+    groq_client = get_groq_client()
     if not groq_client:
         return {"error": "GROQ_API_KEY not configured", "price": None}
     
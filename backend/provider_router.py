@@ -0,0 +1,112 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict
+
+# Circuit breaker tuning
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 3))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", 60))
+HEALTH_WINDOW = int(os.getenv("PROVIDER_HEALTH_WINDOW", 50))
+
+
+class CircuitBreaker:
+    """
+    Rolling latency/error tracker for one provider tier (e.g. "gemini:gemini-2.5-pro").
+    After `failure_threshold` consecutive failures the circuit opens and callers
+    skip this tier; after `reset_seconds` one trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS, window: int = HEALTH_WINDOW):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window)   # True = success
+        self._latencies = deque(maxlen=window)  # seconds, successful calls only
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_started = None
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.time() - self.opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """True if a call should be attempted on this tier now."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            # One trial call at a time; a trial that never reported back is retried
+            now = time.time()
+            if state == "half_open" and (self._trial_started is None
+                                         or now - self._trial_started >= self.reset_seconds):
+                self._trial_started = now
+                return True
+            return False
+
+    def record_success(self, latency: float) -> None:
+        with self._lock:
+            self._outcomes.append(True)
+            self._latencies.append(latency)
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self._trial_started = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._outcomes.append(False)
+            self.consecutive_failures += 1
+            trial_failed = self._trial_started is not None
+            if trial_failed or self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.times_opened += 1
+                self.opened_at = time.time()
+            self._trial_started = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            outcomes = list(self._outcomes)
+            p50 = latencies[len(latencies) // 2] if latencies else None
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+            return {
+                "state": self.state,
+                "calls": len(outcomes),
+                "error_rate": round(outcomes.count(False) / len(outcomes), 4) if outcomes else None,
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+            }
+
+
+class ProviderRouter:
+    """Registry of circuit breakers, one per provider tier, created on first use."""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(name, CircuitBreaker(name))
+        return breaker
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {name: breaker.snapshot() for name, breaker in sorted(breakers.items())}
+
+
+router = ProviderRouter()
@@ -0,0 +1,125 @@
+"""
+Fast photo-quality gate run before any provider call: blur (variance of the
+Laplacian), exposure and vegetation coverage. Unusable photos get an immediate
+"retake photo" result instead of a multi-second, paid diagnosis.
+"""
+import os
+import time
+import threading
+import numpy as np
+from typing import Any, Dict
+
+from . import leaf_analyzer
+
+QUALITY_GATE = os.getenv("QUALITY_GATE", "true").lower() == "true"
+# Measured on a copy with this longest edge (thresholds below are tuned for it)
+QUALITY_CHECK_SIZE = int(os.getenv("QUALITY_CHECK_SIZE", 512))
+# Variance of the 4-neighbour Laplacian of 0-255 grey levels
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", 20))
+# Mean brightness (0-1) bounds, and the share of crushed/clipped pixels allowed
+QUALITY_MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", 0.12))
+QUALITY_MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", 0.9))
+QUALITY_MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", 0.5))
+# Share of the frame that must be plant-coloured (see leaf_analyzer.plant_coverage)
+QUALITY_MIN_COVERAGE = float(os.getenv("QUALITY_MIN_COVERAGE", 0.05))
+
+# Reason code -> advice shown to the user
+RETAKE_ADVICE = {
+    "blurry": "The photo is blurry. Hold the phone steady and tap the leaf to focus.",
+    "too_dark": "The photo is too dark. Move into daylight or turn on more light.",
+    "too_bright": "The photo is overexposed. Avoid direct sun or flash on the leaf.",
+    "no_plant": "No leaf is visible. Fill most of the frame with the affected leaf.",
+}
+
+
+class QualityStats:
+    """Checked / rejected counters per reason for the quality gate."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rejected = 0
+        self.reasons = {reason: 0 for reason in RETAKE_ADVICE}
+        self.seconds = 0.0
+
+    def record(self, reasons, seconds: float) -> None:
+        with self._lock:
+            self.checked += 1
+            self.seconds += seconds
+            if reasons:
+                self.rejected += 1
+            for reason in reasons:
+                self.reasons[reason] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checked": self.checked,
+                "rejected": self.rejected,
+                "reject_rate": round(self.rejected / self.checked, 4) if self.checked else 0.0,
+                "reasons": dict(self.reasons),
+                "avg_ms": round(1000 * self.seconds / self.checked, 2) if self.checked else None,
+            }
+
+
+stats = QualityStats()
+
+
+def sharpness(grey: np.ndarray) -> float:
+    """Variance of the 4-neighbour Laplacian; low values mean little fine detail (blur)."""
+    laplacian = (grey[:-2, 1:-1] + grey[2:, 1:-1] + grey[1:-1, :-2] + grey[1:-1, 2:]
+                 - 4.0 * grey[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def check_image(image, size: int = QUALITY_CHECK_SIZE) -> Dict[str, Any]:
+    """
+    Quality report for a path or bytes-like image:
+    {"ok": bool, "reasons": [codes], "metrics": {...}}.
+    """
+    started = time.perf_counter()
+    rgb = leaf_analyzer.load_rgb(image, size)
+    grey = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    metrics = {
+        "sharpness": round(sharpness(grey), 2),
+        "brightness": round(float(grey.mean()) / 255.0, 4),
+        "dark_fraction": round(float(np.count_nonzero(grey < 20)) / grey.size, 4),
+        "clipped_fraction": round(float(np.count_nonzero(grey > 250)) / grey.size, 4),
+        "coverage": leaf_analyzer.plant_coverage(rgb),
+    }
+
+    reasons = []
+    if metrics["brightness"] < QUALITY_MIN_BRIGHTNESS or metrics["dark_fraction"] > QUALITY_MAX_CLIPPED:
+        reasons.append("too_dark")
+    elif metrics["brightness"] > QUALITY_MAX_BRIGHTNESS or metrics["clipped_fraction"] > QUALITY_MAX_CLIPPED:
+        reasons.append("too_bright")
+    if metrics["sharpness"] < QUALITY_MIN_SHARPNESS:
+        reasons.append("blurry")
+    # Colour segmentation is meaningless on a black or blown-out frame
+    if not reasons or reasons == ["blurry"]:
+        if metrics["coverage"] < QUALITY_MIN_COVERAGE:
+            reasons.append("no_plant")
+
+    elapsed = time.perf_counter() - started
+    metrics["ms"] = round(elapsed * 1000, 2)
+    stats.record(reasons, elapsed)
+    return {"ok": not reasons, "reasons": reasons, "metrics": metrics}
+
+
+def retake_result(report: Dict[str, Any]) -> Dict[str, Any]:
+    """Provider-shaped "retake photo" result (zero confidence, so it is never cached)."""
+    advice = " ".join(RETAKE_ADVICE[reason] for reason in report["reasons"])
+    return {
+        "plant_name": "Unknown",
+        "disease_name": "Retake Photo",
+        "confidence": 0.0,
+        "details": {
+            "severity": "Unknown",
+            "symptoms": advice,
+            "prevention": "Photograph one leaf in daylight, filling most of the frame, with the camera steady.",
+            "treatment": "Retake the photo and try again.",
+        },
+        "source": "quality_gate",
+        "quality_issues": report["reasons"],
+    }
@@ -18,6 +18,12 @@ class PredictionResult(BaseModel):
     disease_name: str
     confidence: float
     details: Optional[DiseaseBase] = None
+    # Local model version that produced this result (None for cloud providers)
+    model_version: Optional[str] = None
+    # Set when the photo was rejected before diagnosis, e.g. ["blurry", "too_dark"]
+    quality_issues: Optional[List[str]] = None
+    # What produced the result, when known: "gemini", "plant_id", "local_model", "leaf_analyzer"...
+    source: Optional[str] = None
 
 class UserCreate(BaseModel):
     username: str
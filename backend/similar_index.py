@@ -0,0 +1,204 @@
+import io
+import os
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from PIL import Image
+from typing import Any, Dict, Optional
+
+from .cache import CACHE_DB_PATH
+from . import leaf_analyzer
+
+# Near-duplicate lookup of past diagnoses (same leaf, slightly different photo)
+SIMILAR_INDEX_PATH = os.getenv("SIMILAR_INDEX_PATH", "./similar_index.f32")
+SIMILAR_INDEX_CAPACITY = int(os.getenv("SIMILAR_INDEX_CAPACITY", 20000))
+SIMILAR_THRESHOLD = float(os.getenv("SIMILAR_THRESHOLD", 0.99))
+# The embedding only sees the overall layout of the photo, not small lesions, so an
+# embedding match is only reused when the leaf's symptom measurements agree too:
+# lesion/yellowing/powdery fractions within SYMPTOM_TOLERANCE of the leaf area and
+# lesion counts within SPOT_TOLERANCE (+10% of the count)
+SYMPTOM_TOLERANCE = float(os.getenv("SIMILAR_SYMPTOM_TOLERANCE", 0.005))
+SPOT_TOLERANCE = int(os.getenv("SIMILAR_SPOT_TOLERANCE", 1))
+SYMPTOM_FIELDS = ("chlorosis", "necrosis", "powdery")
+
+# Perceptual embedding: low-frequency DCT of a 32x32 YCbCr thumbnail
+EMBED_SIZE = 32
+EMBED_FREQS = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Orthonormal DCT-II basis, so `D @ x @ D.T` is the 2-D DCT of an n x n block."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d.astype(np.float32)
+
+
+_DCT = _dct_matrix(EMBED_SIZE)[:EMBED_FREQS]
+# Everything but the DC term: brightness/colour cast shifts alone shouldn't match
+_AC = np.ones((EMBED_FREQS, EMBED_FREQS), dtype=bool)
+_AC[0, 0] = False
+EMBED_DIM = 3 * int(_AC.sum())
+
+
+def perceptual_embedding(image) -> np.ndarray:
+    """
+    Unit-length float32 vector for a path or bytes-like image. Re-shot or re-encoded
+    photos of the same leaf land close together under cosine similarity.
+    """
+    source = image if isinstance(image, (str, os.PathLike)) else io.BytesIO(bytes(image))
+    with Image.open(source) as img:
+        img.draft("RGB", (EMBED_SIZE * 2, EMBED_SIZE * 2))
+        img = img.convert("YCbCr").resize((EMBED_SIZE, EMBED_SIZE), Image.BOX)
+        planes = np.asarray(img, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    coefficients = _DCT @ planes @ _DCT.T  # (3, EMBED_FREQS, EMBED_FREQS)
+    vector = coefficients[:, _AC].ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def leaf_symptoms(image) -> Dict[str, Any]:
+    """Symptom measurements (see leaf_analyzer) used to confirm an embedding match."""
+    features = leaf_analyzer.analyze_leaf(image)
+    return {field: features[field] for field in SYMPTOM_FIELDS + ("spots",)}
+
+
+def same_symptoms(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]) -> bool:
+    if not a or not b:
+        return False
+    if any(abs(a[field] - b[field]) > SYMPTOM_TOLERANCE for field in SYMPTOM_FIELDS):
+        return False
+    return abs(a["spots"] - b["spots"]) <= SPOT_TOLERANCE + 0.1 * max(a["spots"], b["spots"])
+
+
+def image_signature(image):
+    """(embedding, symptoms) for one path or bytes-like image."""
+    return perceptual_embedding(image), leaf_symptoms(image)
+
+
+class SimilarIndex:
+    """
+    Fixed-capacity ring buffer of (embedding, diagnosis) pairs. Embeddings live in a
+    memory-mapped float32 matrix on disk; diagnoses and slot bookkeeping live in a
+    SQLite table. Once full, each append overwrites the oldest slot. A stored
+    diagnosis is only returned when the leaf symptoms stored with it also match.
+    """
+
+    def __init__(self, name: str = "similar_index", path: str = SIMILAR_INDEX_PATH,
+                 capacity: int = SIMILAR_INDEX_CAPACITY, threshold: float = SIMILAR_THRESHOLD,
+                 db_path: str = CACHE_DB_PATH, dim: int = EMBED_DIM):
+        self.name = name
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._valid = np.zeros(capacity, dtype=bool)
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.appends = 0
+        self.evictions = 0
+        self.search_seconds = 0.0
+
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {self.name} ("
+            "slot INTEGER PRIMARY KEY, seq INTEGER NOT NULL, "
+            "result TEXT NOT NULL, created REAL NOT NULL, symptoms TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({self.name})")}
+        if "symptoms" not in columns:
+            # Older rows have no symptoms, so they can never be confirmed (i.e. never reused)
+            self._conn.execute(f"ALTER TABLE {self.name} ADD COLUMN symptoms TEXT")
+        self._conn.commit()
+
+        expected_bytes = capacity * dim * 4
+        if os.path.exists(path) and os.path.getsize(path) != expected_bytes:
+            # Capacity or embedding changed: start over rather than mis-read old rows
+            print(f"[WARN] {self.name}: layout changed, rebuilding {path}")
+            os.remove(path)
+            self._conn.execute(f"DELETE FROM {self.name}")
+            self._conn.commit()
+        mode = "r+" if os.path.exists(path) else "w+"
+        self._vectors = np.memmap(path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+
+        rows = self._conn.execute(f"SELECT slot, seq FROM {self.name} WHERE slot < ?", (capacity,)).fetchall()
+        for slot, seq in rows:
+            self._valid[slot] = True
+            self._seq = max(self._seq, seq + 1)
+
+    def search(self, vector: np.ndarray, symptoms: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Stored diagnosis of the most similar past image, or None below the threshold
+        or when the two leaves' symptoms differ.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            slot, similarity = None, -1.0
+            # Slots fill in order, so only the first `filled` rows can hold entries
+            filled = min(self._seq, self.capacity)
+            if filled:
+                # Rows are unit-length, so the dot product is the cosine similarity
+                similarities = self._vectors[:filled] @ vector
+                similarities[~self._valid[:filled]] = -1.0
+                slot = int(np.argmax(similarities))
+                similarity = float(similarities[slot])
+            self.search_seconds += time.perf_counter() - started
+
+            if slot is None or similarity < self.threshold:
+                self.misses += 1
+                return None
+            row = self._conn.execute(f"SELECT result, symptoms FROM {self.name} WHERE slot = ?",
+                                     (slot,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if not same_symptoms(symptoms, json.loads(row[1]) if row[1] else None):
+                self.misses += 1
+                self.rejected += 1
+                print(f"Similar image (similarity {similarity:.3f}) rejected: leaf symptoms differ")
+                return None
+            self.hits += 1
+            print(f"Near-duplicate of a past diagnosis (similarity {similarity:.3f})")
+            return json.loads(row[0])
+
+    def add(self, vector: np.ndarray, result: Dict[str, Any], symptoms: Dict[str, Any]) -> None:
+        with self._lock:
+            slot = self._seq % self.capacity
+            if self._valid[slot]:
+                self.evictions += 1
+            self._vectors[slot] = vector
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.name} (slot, seq, result, created, symptoms) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (slot, self._seq, json.dumps(result), time.time(), json.dumps(symptoms))
+            )
+            self._conn.commit()
+            self._valid[slot] = True
+            self._seq += 1
+            self.appends += 1
+
+    def flush(self) -> None:
+        with self._lock:
+            self._vectors.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "rejected": self.rejected,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": int(self._valid.sum()),
+                "capacity": self.capacity,
+                "appends": self.appends,
+                "evictions": self.evictions,
+                "avg_search_ms": round(1000 * self.search_seconds / lookups, 3) if lookups else None,
+                "threshold": self.threshold,
+            }
@@ -1,5 +1,20 @@
+"""
+Train the MobileNetV2 classifier and publish it as a new model version.
+
+Run from the project root:
+    python -m backend.train                      # cached bottleneck features, head only
+    python -m backend.train --fine-tune          # ...then unfreeze the top of the backbone
+    python -m backend.train --mode end_to_end    # original augmentation + backbone every epoch
+
+Reads pre-resized shards from datasets/shards when `python -m backend.dataset_shards`
+has been run, otherwise decodes the JPEGs in datasets/processed_v2 directly.
+"""
 import os
 import json
+import time
+import hashlib
+import argparse
+import numpy as np
 import tensorflow as tf
 from pathlib import Path
 from tensorflow.keras.applications import MobileNetV2
@@ -8,80 +23,319 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping
 
+from .ml_engine import publish_version
+from .dataset_shards import SHARDS_DIR, convert_split, is_current, load_index, shard_dataset
+
 # Configuration
 BATCH_SIZE = 8
 IMG_SIZE = (160, 160)
-EPOCHS = 1
+EPOCHS = 5
 LEARNING_RATE = 0.0001
 DATA_DIR = Path("datasets/processed_v2")
 MODELS_DIR = Path("models")
 MODELS_DIR.mkdir(exist_ok=True)
 
-def train_model():
-    print(f"TensorFlow Version: {tf.__version__}")
-    print(f"Checking data directory: {DATA_DIR.absolute()}")
-    
-    if not DATA_DIR.exists():
-        print(f"Error: Data directory {DATA_DIR} not found!")
-        return
+# Bottleneck-feature mode: the frozen backbone runs once per image (and per
+# augmentation variant); only the Dense head is trained on the cached features
+FEATURES_DIR = MODELS_DIR / "features"
+FEATURE_SHARD_SIZE = 4096
+EXTRACT_BATCH_SIZE = 64
+HEAD_BATCH_SIZE = 256
+HEAD_LEARNING_RATE = 0.001
+AUGMENT_VARIANTS = 2
+# Fine-tuning (end-to-end) after the head has converged
+FINE_TUNE_LAYERS = 30
+FINE_TUNE_EPOCHS = 3
+FINE_TUNE_LEARNING_RATE = 0.00001
+REPORT_PATH = MODELS_DIR / "training_report.json"
 
-    # Load Datasets
-    print("Loading datasets...")
-    train_ds = tf.keras.utils.image_dataset_from_directory(
-        DATA_DIR / "train",
-        seed=123,
-        image_size=IMG_SIZE,
-        batch_size=BATCH_SIZE,
-        label_mode='categorical'
-    )
-    
-    val_ds = tf.keras.utils.image_dataset_from_directory(
-        DATA_DIR / "val",
+def build_augmentation():
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomFlip("horizontal_and_vertical"),
+        tf.keras.layers.RandomRotation(0.2),
+        tf.keras.layers.RandomZoom(0.2),
+    ])
+
+_shards_checked = {}
+
+def has_shards(split):
+    """Whether the split can be read from shards; shards older than processed_v2 are rebuilt first."""
+    if split not in _shards_checked:
+        if load_index(split) is not None and not is_current(split, DATA_DIR):
+            print(f"Shards for '{split}' don't match {DATA_DIR / split} any more; reconverting...")
+            convert_split(split, DATA_DIR)
+        _shards_checked[split] = load_index(split) is not None
+    return _shards_checked[split]
+
+def load_split(split, batch_size, shuffle=True):
+    if has_shards(split):
+        return shard_dataset(split, batch_size, shuffle=shuffle)
+    return tf.keras.utils.image_dataset_from_directory(
+        DATA_DIR / split,
         seed=123,
+        shuffle=shuffle,
         image_size=IMG_SIZE,
-        batch_size=BATCH_SIZE,
+        batch_size=batch_size,
         label_mode='categorical'
     )
 
-    # Save Class Indices
-    class_names = train_ds.class_names
-    print(f"Found {len(class_names)} classes: {class_names}")
-    
+def save_class_indices(class_names):
     class_indices = {name: i for i, name in enumerate(class_names)}
     with open(MODELS_DIR / "class_indices.json", "w") as f:
         json.dump(class_indices, f, indent=4)
     print(f"Saved class indices to {MODELS_DIR / 'class_indices.json'}")
 
-    # Performance Optimization
-    AUTOTUNE = tf.data.AUTOTUNE
-    train_ds = train_ds.cache().shuffle(1000).prefetch(buffer_size=AUTOTUNE)
-    val_ds = val_ds.cache().prefetch(buffer_size=AUTOTUNE)
-
-    # Data Augmentation
-    data_augmentation = tf.keras.Sequential([
-        tf.keras.layers.RandomFlip("horizontal_and_vertical"),
-        tf.keras.layers.RandomRotation(0.2),
-        tf.keras.layers.RandomZoom(0.2),
-    ])
-
+def build_model(num_classes, augment=True):
+    """Full classifier; returns (model, base_model, head_layers)."""
     # Base Model (MobileNetV2)
-    print("Building model...")
     base_model = MobileNetV2(input_shape=IMG_SIZE + (3,),
                              include_top=False,
                              weights='imagenet')
-    
     base_model.trainable = False # Freeze base model initially
 
     # Custom Head
     inputs = tf.keras.Input(shape=IMG_SIZE + (3,))
-    x = data_augmentation(inputs)
+    x = build_augmentation()(inputs) if augment else inputs
     x = tf.keras.applications.mobilenet_v2.preprocess_input(x)
     x = base_model(x, training=False)
     x = GlobalAveragePooling2D()(x)
-    x = Dropout(0.2)(x)
-    outputs = Dense(len(class_names), activation='softmax')(x)
-    
-    model = Model(inputs, outputs)
+    dropout = Dropout(0.2)
+    dense = Dense(num_classes, activation='softmax')
+    outputs = dense(dropout(x))
+    return Model(inputs, outputs), base_model, dense
+
+def fit_timed(model, train_ds, images_per_epoch, **kwargs):
+    """model.fit plus training throughput (images/sec, validation excluded)."""
+    epoch_seconds = []
+
+    class EpochTimer(tf.keras.callbacks.Callback):
+        def on_epoch_begin(self, epoch, logs=None):
+            self.started = time.perf_counter()
+
+        def on_epoch_end(self, epoch, logs=None):
+            epoch_seconds.append(time.perf_counter() - self.started)
+
+    kwargs["callbacks"] = list(kwargs.get("callbacks", [])) + [EpochTimer()]
+    history = model.fit(train_ds, **kwargs)
+    seconds = sum(epoch_seconds)
+    return history, {
+        "epochs": len(epoch_seconds),
+        "seconds": round(seconds, 2),
+        "images_per_sec": round(images_per_epoch * len(epoch_seconds) / seconds, 1) if seconds else None,
+    }
+
+def dataset_fingerprint(split):
+    """Changes whenever an image in the split (or its shards) is added, removed or rewritten."""
+    root = SHARDS_DIR if has_shards(split) else DATA_DIR
+    digest = hashlib.sha256(f"mobilenet_v2:{IMG_SIZE}:{root}".encode())
+    for path in sorted((root / split).rglob("*")):
+        if path.is_file():
+            stat = path.stat()
+            digest.update(f"{path.relative_to(root)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+def extract_features(split, variant, feature_model, augmentation):
+    """
+    Run the frozen backbone over one split (variant 0 = original images, N > 0 =
+    Nth random augmentation) into float16 .npy shards of FEATURE_SHARD_SIZE rows.
+    Reuses existing shards when the split hasn't changed. Returns (shard dir, stats).
+    """
+    out_dir = FEATURES_DIR / f"{split}-v{variant}"
+    fingerprint = dataset_fingerprint(split)
+    meta_path = out_dir / "meta.json"
+    if meta_path.exists():
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") == fingerprint:
+            print(f"Reusing cached features in {out_dir} ({meta['count']} images)")
+            return out_dir, {"cached": True, "count": meta["count"]}
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for stale in out_dir.glob("*.npy"):
+        stale.unlink()
+
+    ds = load_split(split, EXTRACT_BATCH_SIZE, shuffle=False)
+    num_classes = len(ds.class_names)
+    dim = feature_model.output_shape[-1]
+
+    @tf.function
+    def embed(images):
+        if augmentation is not None:
+            images = augmentation(images, training=True)
+        images = tf.keras.applications.mobilenet_v2.preprocess_input(images)
+        return feature_model(images, training=False)
+
+    print(f"Extracting {split} features (variant {variant})...")
+    started = time.perf_counter()
+    count = 0
+    shard = 0
+    features = labels = None
+    filled = 0
+    for images, onehot in ds:
+        batch = embed(images).numpy().astype(np.float16)
+        batch_labels = np.argmax(onehot.numpy(), axis=1).astype(np.int16)
+        start = 0
+        while start < len(batch):
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    out_dir / f"features-{shard:05d}.npy", mode="w+", dtype=np.float16,
+                    shape=(FEATURE_SHARD_SIZE, dim))
+                labels = np.zeros(FEATURE_SHARD_SIZE, dtype=np.int16)
+                filled = 0
+            take = min(len(batch) - start, FEATURE_SHARD_SIZE - filled)
+            features[filled:filled + take] = batch[start:start + take]
+            labels[filled:filled + take] = batch_labels[start:start + take]
+            filled += take
+            start += take
+            count += take
+            if filled == FEATURE_SHARD_SIZE:
+                features.flush()
+                np.save(out_dir / f"labels-{shard:05d}.npy", labels)
+                features = None
+                shard += 1
+    if features is not None:
+        # Last shard is partial: rewrite it at its true length
+        features.flush()
+        partial = np.array(features[:filled])
+        del features
+        np.save(out_dir / f"features-{shard:05d}.npy", partial)
+        np.save(out_dir / f"labels-{shard:05d}.npy", labels[:filled])
+
+    seconds = time.perf_counter() - started
+    with open(meta_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "count": count, "dim": dim,
+                   "num_classes": num_classes, "variant": variant}, f, indent=4)
+    rate = count / seconds if seconds else 0
+    print(f"  {count} images in {seconds:.1f}s ({rate:.1f} images/sec)")
+    return out_dir, {"cached": False, "count": count, "seconds": round(seconds, 2),
+                     "images_per_sec": round(rate, 1)}
+
+def feature_dataset(shard_dirs, num_classes, shuffle):
+    """tf.data over memory-mapped feature shards; only the rows of the current batch are paged in."""
+    shards = []
+    for shard_dir in shard_dirs:
+        for features_path in sorted(shard_dir.glob("features-*.npy")):
+            labels_path = shard_dir / features_path.name.replace("features-", "labels-")
+            shards.append((features_path, labels_path))
+    count = sum(np.load(labels).shape[0] for _, labels in shards)
+    dim = np.load(shards[0][0], mmap_mode="r").shape[1]
+
+    def batches():
+        rng = np.random.default_rng()
+        order = rng.permutation(len(shards)) if shuffle else range(len(shards))
+        for i in order:
+            features = np.load(shards[i][0], mmap_mode="r")
+            labels = np.load(shards[i][1])
+            rows = rng.permutation(len(labels)) if shuffle else np.arange(len(labels))
+            for start in range(0, len(rows), HEAD_BATCH_SIZE):
+                # Sorted row indices keep the memmap reads sequential within a batch
+                index = np.sort(rows[start:start + HEAD_BATCH_SIZE])
+                yield (np.asarray(features[index], dtype=np.float32),
+                       tf.keras.utils.to_categorical(labels[index], num_classes))
+
+    ds = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec(shape=(None, dim), dtype=tf.float32),
+        tf.TensorSpec(shape=(None, num_classes), dtype=tf.float32),
+    ))
+    return ds.prefetch(tf.data.AUTOTUNE), count
+
+def train_head_on_features(epochs, variants, fine_tune):
+    report = {"mode": "features", "extraction": {}}
+    class_names = load_split("train", BATCH_SIZE).class_names
+    print(f"Found {len(class_names)} classes: {class_names}")
+    save_class_indices(class_names)
+
+    print("Building model...")
+    model, base_model, dense = build_model(len(class_names))
+    pooled = GlobalAveragePooling2D()(base_model.output)
+    feature_model = Model(base_model.input, pooled)
+    augmentation = build_augmentation()
+
+    train_dirs = []
+    for variant in range(variants + 1):
+        shard_dir, stats = extract_features("train", variant, feature_model,
+                                            augmentation if variant else None)
+        train_dirs.append(shard_dir)
+        report["extraction"][f"train-v{variant}"] = stats
+    val_dir, stats = extract_features("val", 0, feature_model, None)
+    report["extraction"]["val-v0"] = stats
+
+    train_ds, train_count = feature_dataset(train_dirs, len(class_names), shuffle=True)
+    val_ds, _ = feature_dataset([val_dir], len(class_names), shuffle=False)
+
+    # Head: same Dropout + Dense as the full model, so its weights drop straight in
+    features_in = tf.keras.Input(shape=(feature_model.output_shape[-1],))
+    head_dense = Dense(len(class_names), activation='softmax')
+    head = Model(features_in, head_dense(Dropout(0.2)(features_in)))
+    head.compile(optimizer=Adam(learning_rate=HEAD_LEARNING_RATE),
+                 loss='categorical_crossentropy',
+                 metrics=['accuracy'])
+
+    print(f"Training head on {train_count} cached feature vectors...")
+    _, report["head"] = fit_timed(
+        head, train_ds, train_count,
+        epochs=epochs,
+        validation_data=val_ds,
+        callbacks=[EarlyStopping(monitor='val_loss', patience=5,
+                                 restore_best_weights=True, verbose=1)]
+    )
+    dense.set_weights(head_dense.get_weights())
+
+    model.compile(optimizer=Adam(learning_rate=LEARNING_RATE),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    model.save(MODELS_DIR / "plant_disease_model.keras")
+    print(f"Saved {MODELS_DIR / 'plant_disease_model.keras'}")
+
+    if fine_tune:
+        report["fine_tune"] = fine_tune_end_to_end(model, base_model)
+    return report
+
+def fine_tune_end_to_end(model, base_model):
+    """Unfreeze the top FINE_TUNE_LAYERS of the backbone and train through images again."""
+    base_model.trainable = True
+    for layer in base_model.layers[:-FINE_TUNE_LAYERS]:
+        layer.trainable = False
+    model.compile(optimizer=Adam(learning_rate=FINE_TUNE_LEARNING_RATE),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+
+    train_ds = load_split("train", BATCH_SIZE)
+    val_ds = load_split("val", BATCH_SIZE)
+    images = len(train_ds.file_paths)
+    print(f"Fine-tuning the top {FINE_TUNE_LAYERS} backbone layers end-to-end...")
+    _, stats = fit_timed(
+        model, train_ds.prefetch(tf.data.AUTOTUNE), images,
+        epochs=FINE_TUNE_EPOCHS,
+        validation_data=val_ds.prefetch(tf.data.AUTOTUNE),
+        callbacks=[ModelCheckpoint(filepath=str(MODELS_DIR / "plant_disease_model.keras"),
+                                   save_best_only=True, monitor='val_accuracy',
+                                   mode='max', verbose=1)]
+    )
+    return stats
+
+def train_end_to_end(epochs):
+    # Load Datasets
+    print("Loading datasets...")
+    train_ds = load_split("train", BATCH_SIZE)
+    val_ds = load_split("val", BATCH_SIZE)
+
+    # Save Class Indices
+    class_names = train_ds.class_names
+    print(f"Found {len(class_names)} classes: {class_names}")
+    save_class_indices(class_names)
+    images = len(train_ds.file_paths)
+
+    # Performance Optimization (shards are already decoded, shuffled and prefetched;
+    # cache() only helps the JPEG path, and only while the dataset fits in RAM)
+    AUTOTUNE = tf.data.AUTOTUNE
+    if not has_shards("train"):
+        train_ds = train_ds.cache().shuffle(1000).prefetch(buffer_size=AUTOTUNE)
+    if not has_shards("val"):
+        val_ds = val_ds.cache().prefetch(buffer_size=AUTOTUNE)
+
+    print("Building model...")
+    model, _, _ = build_model(len(class_names))
 
     model.compile(optimizer=Adam(learning_rate=LEARNING_RATE),
                   loss='categorical_crossentropy',
@@ -108,18 +362,74 @@ def train_model():
 
     # Training
     print("Starting training...")
-    history = model.fit(
-        train_ds,
-        epochs=5,
-        validation_data=val_ds,
-        callbacks=callbacks
-    )
-    
+    _, stats = fit_timed(model, train_ds, images,
+                         epochs=epochs,
+                         validation_data=val_ds,
+                         callbacks=callbacks)
+    return {"mode": "end_to_end", "end_to_end": stats}
+
+def print_report(report):
+    print(f"\n{'phase':<22} {'images':>8} {'seconds':>8} {'images/sec':>11}")
+    for name, stats in report.get("extraction", {}).items():
+        if stats.get("cached"):
+            print(f"{'extract ' + name:<22} {stats['count']:>8} {'cached':>8} {'-':>11}")
+        else:
+            print(f"{'extract ' + name:<22} {stats['count']:>8} {stats['seconds']:>8.1f} {stats['images_per_sec']:>11.1f}")
+    for phase in ("head", "fine_tune", "end_to_end"):
+        stats = report.get(phase)
+        if stats:
+            print(f"{phase + ' (per epoch)':<22} {'':>8} {stats['seconds'] / max(stats['epochs'], 1):>8.1f} "
+                  f"{stats['images_per_sec'] or 0:>11.1f}")
+    test = report.get("test")
+    if test:
+        print(f"{'test':<22} {test['images']:>8} {test['seconds']:>8.1f} {test['images_per_sec']:>11.1f}"
+              f"   accuracy {test['accuracy']:.4f}")
+
+def evaluate_test_split():
+    """Accuracy of the saved model on the test split (shards when available)."""
+    model = tf.keras.models.load_model(MODELS_DIR / "plant_disease_model.keras")
+    test_ds = load_split("test", EXTRACT_BATCH_SIZE, shuffle=False)
+    images = len(test_ds.file_paths)
+    print(f"Evaluating on {images} test images...")
+    started = time.perf_counter()
+    _, accuracy = model.evaluate(test_ds, verbose=0)
+    seconds = time.perf_counter() - started
+    return {"images": images, "accuracy": round(float(accuracy), 4), "seconds": round(seconds, 2),
+            "images_per_sec": round(images / seconds, 1) if seconds else None}
+
+def train_model(mode="features", epochs=EPOCHS, variants=AUGMENT_VARIANTS, fine_tune=False):
+    print(f"TensorFlow Version: {tf.__version__}")
+    print(f"Checking data directory: {DATA_DIR.absolute()}")
+
+    if not (DATA_DIR.exists() or has_shards("train")):
+        print(f"Error: Data directory {DATA_DIR} not found!")
+        return
+    print(f"Reading {'shards from ' + str(SHARDS_DIR) if has_shards('train') else 'JPEGs from ' + str(DATA_DIR)}")
+
+    if mode == "end_to_end":
+        report = train_end_to_end(epochs)
+    else:
+        report = train_head_on_features(epochs, variants, fine_tune)
+
     print("Training finished.")
-    
-    # Optional: Fine-tuning (Unfreeze some layers)
-    # base_model.trainable = True
-    # ... recompile and fit with lower LR ...
+    if has_shards("test") or (DATA_DIR / "test").exists():
+        report["test"] = evaluate_test_split()
+    print_report(report)
+    with open(REPORT_PATH, "w") as f:
+        json.dump(report, f, indent=4)
+
+    # Running servers pick the new version up on their next watcher poll
+    publish_version([MODELS_DIR / "plant_disease_model.keras", MODELS_DIR / "class_indices.json"],
+                    models_dir=MODELS_DIR)
 
 if __name__ == "__main__":
-    train_model()
+    parser = argparse.ArgumentParser(description="Train the plant disease classifier.")
+    parser.add_argument("--mode", choices=["features", "end_to_end"], default="features",
+                        help="features: cache frozen-backbone outputs and train the head on them (default)")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--variants", type=int, default=AUGMENT_VARIANTS,
+                        help="augmented feature copies per training image, besides the original")
+    parser.add_argument("--fine-tune", action="store_true",
+                        help="after head training, train the top backbone layers end-to-end")
+    args = parser.parse_args()
+    train_model(mode=args.mode, epochs=args.epochs, variants=args.variants, fine_tune=args.fine_tune)
@@ -0,0 +1,41 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict
+
+# Heavy components (SDKs, models, DB schema) are loaded lazily or by the
+# background warm-up task; each one records here when it becomes available.
+_lock = threading.Lock()
+_components: Dict[str, Dict[str, Any]] = {}
+
+
+def record(name: str, seconds: float, error: str = None) -> None:
+    with _lock:
+        _components[name] = {
+            "loaded": error is None,
+            "seconds": round(seconds, 3),
+            "error": error,
+            "at": time.time(),
+        }
+
+
+@contextmanager
+def timed(name: str):
+    """Time a lazy load and record it (including failures) for /ready."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        record(name, time.perf_counter() - started, str(e))
+        raise
+    record(name, time.perf_counter() - started)
+
+
+def is_loaded(name: str) -> bool:
+    with _lock:
+        return bool(_components.get(name, {}).get("loaded"))
+
+
+def status() -> Dict[str, Dict[str, Any]]:
+    with _lock:
+        return {name: dict(info) for name, info in _components.items()}
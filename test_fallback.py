@@ -8,7 +8,7 @@ sys.path.append(os.getcwd())
 # Load env vars
 load_dotenv()
 
-from backend.ml_engine import detector
+from backend.ml_engine import get_detector
 from backend import gemini_client
 
 # Path to the uploaded image
@@ -22,7 +22,7 @@ print(f"Testing full flow on: {image_path}")
 
 # 1. Local Prediction
 print("\n--- Step 1: Local Model Prediction ---")
-local_result = detector.predict(image_path)
+local_result = get_detector().predict(image_path)
 print(f"Local Result: {local_result}")
 
 # 2. Fallback Logic
@@ -4,7 +4,7 @@ import os
 # Add the current directory to sys.path so we can import backend
 sys.path.append(os.getcwd())
 
-from backend.ml_engine import detector
+from backend.ml_engine import get_detector
 
 # Path to the uploaded image (from metadata)
 image_path = r"C:/Users/hp/.gemini/antigravity/brain/6ddf77a4-6708-46b1-9c1a-26b14f395c3e/uploaded_image_1764691325499.png"
@@ -14,7 +14,7 @@ if not os.path.exists(image_path):
     sys.exit(1)
 
 print(f"Testing prediction on: {image_path}")
-result = detector.predict(image_path)
+result = get_detector().predict(image_path)
 print("Prediction Result:")
 print(result)
 